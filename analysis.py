@@ -0,0 +1,97 @@
+#!/usr/bin/python3
+# This script holds the per-question analysis that is shared by all stages of the system
+# Authors: Jasper Bos (s3794687); Djim C. Casander (s3162753); Esther Ploeger (s3798461)
+# Date:    June 8th, 2021
+
+from models import get_nlp, ENTITY_LINKER
+from system_libs import call_entitylinker
+from metrics import timer
+
+
+class QuestionAnalysis:
+    """
+    Linguistic analysis of one question. The question is parsed once and the
+    resulting Doc, lemmas, POS tags, dependencies and linked entities are
+    passed to every stage instead of re-parsing the question.
+    """
+
+    __slots__ = ('doc', 'text', 'lemmas', 'lemma_set', 'pos', 'dep', 'quotes', 'titles', 'sent', 'linked_entities')
+
+    def __init__(self, doc, linked_entities=None):
+        """
+        :param doc: nlp parse of input question (spacy doc object)
+        :param linked_entities: entities found by the entity linker, key: id and value: label (dict)
+        """
+
+        self.doc = doc
+        self.text = doc.text
+        self.lemmas = []
+        self.pos = []
+        self.dep = []
+        self.quotes = []  # Positions of the double quotes, which may enclose the entity
+        self.titles = []  # Positions of the title-case words after the first word
+        for word in doc:
+            self.lemmas.append(word.lemma_)
+            self.pos.append(word.pos_)
+            self.dep.append(word.dep_)
+            if word.text == '"':
+                self.quotes.append(word.i)
+            if word.text.istitle() and word.i != 0:
+                self.titles.append(word.i)
+        self.lemma_set = frozenset(self.lemmas)  # For the keyword rules
+
+        sent = doc.text.replace("?", "")  # Strip question mark
+        sent = sent.replace('"', "")  # Strip double apostrophe
+        self.sent = sent.replace("'", "")  # Strip single apostrophe
+
+        self.linked_entities = linked_entities if linked_entities is not None else dict()
+
+    def __len__(self):
+        return len(self.doc)
+
+    def __iter__(self):
+        return iter(self.doc)
+
+    def __getitem__(self, i):
+        return self.doc[i]
+
+
+def analyse_question(q, model=None):
+    """
+    Parses a question once and collects everything the other stages need
+    :param q: input question, plain text (str)
+    :param model: spacy language model with the entity linker pipe, the shared model if None
+    :return: analysis of the question (QuestionAnalysis)
+    """
+
+    if model is None:
+        model = get_nlp(entity_linker=True)
+    with timer('parse'):
+        doc = model(q, disable=[ENTITY_LINKER])
+    return QuestionAnalysis(doc, call_entitylinker(doc))
+
+
+def analyse_questions(questions, batch_size=64, n_process=1, model=None):
+    """
+    Streams questions through nlp.pipe and yields their analyses in input order
+    :param questions: iterable of (question, context) tuples, the context is passed along untouched
+    :param batch_size: number of questions spacy parses per batch (int)
+    :param n_process: number of processes used for parsing (int)
+    :param model: spacy language model with the entity linker pipe, the shared model if None
+    :return: generator of (analysis, context) tuples
+    """
+
+    if model is None:
+        model = get_nlp(entity_linker=True)
+
+    # The entity linker runs on every parsed question in this process, so that it can be timed
+    # separately and because linked entities do not survive the transfer between processes
+    docs = iter(model.pipe(questions, as_tuples=True, batch_size=batch_size, n_process=n_process,
+                           disable=[ENTITY_LINKER]))
+    while True:
+        with timer('parse'):  # Time spent waiting for the next parsed question
+            item = next(docs, None)
+        if item is None:
+            break
+        doc, context = item
+        yield QuestionAnalysis(doc, call_entitylinker(doc)), context
@@ -0,0 +1,191 @@
+#!/usr/bin/python3
+# This script keeps a persistent cache of the answers to questions that were asked before
+# Authors: Jasper Bos (s3794687); Djim C. Casander (s3162753); Esther Ploeger (s3798461)
+# Date:    June 8th, 2021
+
+import hashlib
+import itertools
+import json
+from collections import deque
+from answers import QuestionResult, choose_answer_filter
+from analysis import analyse_questions
+from cache import ResponseCache
+from models import MODEL_NAME
+from rules import KEYWORD_RULES, TYPE_RULES
+
+ANSWER_CACHE_PATH = '.lt_answers.sqlite'
+ANSWER_CACHE_MAX_ENTRIES = 100000
+ANSWER_CACHE_VERSION = 2  # Increase when answers change in a way the version stamp does not cover
+
+
+def model_version(name=MODEL_NAME):
+    """
+    :param name: name of the spacy model (str)
+    :return: installed version of the model, without loading it (str)
+    """
+
+    try:
+        from importlib.metadata import version, PackageNotFoundError
+        return version(name)
+    except (ImportError, PackageNotFoundError):
+        return ''
+
+
+def version_stamp(config=None):
+    """
+    Builds the stamp of everything that decides the answers: the model, the keyword rules and the options
+    :param config: options that change the answers, e.g. the local indexes (dict)
+    :return: version stamp (str)
+    """
+
+    parts = [ANSWER_CACHE_VERSION, MODEL_NAME, model_version(), repr(KEYWORD_RULES), repr(TYPE_RULES),
+             sorted((config or dict()).items())]
+    return hashlib.sha256(json.dumps(parts, default=str).encode('utf-8')).hexdigest()
+
+
+def question_key(q):
+    """
+    :param q: normalised question (str)
+    :return: first level key (str)
+    """
+
+    return 'q\t' + " ".join(q.split())
+
+
+def candidates_key(question_type, answer_filter, ents, props):
+    """
+    :param question_type: question type abbreviation (str)
+    :param answer_filter: chosen with choose_answer_filter, e.g. only the year of a date (function)
+    :param ents: possible entities, in priority order (dict)
+    :param props: possible properties, in priority order (dict)
+    :return: second level key (str)
+    """
+
+    return 'c\t' + json.dumps([question_type, answer_filter.__name__, list(ents), list(props)])
+
+
+class AnswerCache(ResponseCache):
+    """
+    Answers of earlier questions stored in SQLite, on two levels: the whole
+    result by the normalised question, so that a repeated question is not
+    parsed at all, and the answer by the question type and candidates, so
+    that another phrasing of the same question does not query Wikidata
+    again. Entries of another version stamp are removed when it is opened.
+    """
+
+    def __init__(self, path=ANSWER_CACHE_PATH, max_entries=ANSWER_CACHE_MAX_ENTRIES, version=None):
+        """
+        :param path: path to the SQLite file (str)
+        :param max_entries: maximum number of entries before the least recently used are evicted (int)
+        :param version: version stamp of the answers (str)
+        """
+
+        super().__init__(path, ttl=None, max_entries=max_entries, name='answer_cache')
+        self.version = version or version_stamp()
+        with self._lock:
+            self._conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+            row = self._conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+            if row is None or row[0] != self.version:  # Other model, rules or options
+                self._conn.execute('DELETE FROM responses')
+                self._conn.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (self.version,))
+
+    def recall(self, q):
+        """
+        :param q: normalised question (str)
+        :return: result of the question (QuestionResult), None if it was not asked before
+        """
+
+        record = self.get(question_key(q))
+        return QuestionResult.from_dict(record) if record is not None else None
+
+    def recall_candidates(self, question_type, answer_filter, ents, props):
+        """
+        :param question_type: question type abbreviation (str)
+        :param answer_filter: chosen with choose_answer_filter (function)
+        :param ents: possible entities (dict)
+        :param props: possible properties (dict)
+        :return: entity and property that gave the answer (tuple) and answer (list or int), None if not cached
+        """
+
+        record = self.get(candidates_key(question_type, answer_filter, ents, props))
+        if record is None:
+            return None
+        return tuple(record['pair']) if record['pair'] else None, record['answer']
+
+    def store(self, result):
+        """
+        Stores the answer of a question on both levels
+        :param result: result of the question (QuestionResult)
+        """
+
+        self.set(question_key(result.question), result.to_dict())
+        answer_filter = choose_answer_filter(result.question)  # The form of the answer, e.g. only the year
+        self.set(candidates_key(result.question_type, answer_filter, result.entities, result.properties),
+                 {'pair': result.pair, 'answer': result.answer})
+
+
+_cache = None  # Shared cache, None means every question is answered
+
+
+def configure(path=ANSWER_CACHE_PATH, max_entries=ANSWER_CACHE_MAX_ENTRIES, config=None):
+    """
+    Enables the shared answer cache
+    :param path: path to the SQLite file, None disables the cache (str)
+    :param max_entries: maximum number of entries (int)
+    :param config: options that change the answers, part of the version stamp (dict)
+    :return: the shared cache (AnswerCache)
+    """
+
+    global _cache
+    if _cache is not None:
+        _cache.close()
+    _cache = AnswerCache(path, max_entries, version_stamp(config)) if path else None
+    return _cache
+
+
+def get_answer_cache():
+    return _cache
+
+
+def recall_or_analyse(questions, batch_size=64, n_process=1, model=None):
+    """
+    Like analyse_questions, but only parses the questions that are not in the shared cache
+    :param questions: iterable of (normalised question, context) tuples
+    :param batch_size: number of questions spacy parses per batch (int)
+    :param n_process: number of processes used for parsing (int)
+    :param model: spacy language model with the entity linker pipe, the shared model if None
+    :return: generator of (analysis or cached result, context) tuples, in input order
+    """
+
+    if _cache is None:
+        yield from analyse_questions(questions, batch_size, n_process, model)
+        return
+
+    waiting = deque()  # (cached result or None, context) in input order, None is being parsed
+    questions = iter(questions)
+
+    def misses():
+        for q, context in questions:
+            result = _cache.recall(q)
+            waiting.append((result, context))
+            if result is None:
+                yield q, context
+
+    # The model is only loaded once a question is not cached
+    for q, context in questions:
+        result = _cache.recall(q)
+        if result is None:
+            waiting.append((None, context))
+            first = [(q, context)]
+            break
+        yield result, context
+    else:
+        return
+
+    for analysis, context in analyse_questions(itertools.chain(first, misses()), batch_size, n_process, model):
+        while waiting[0][0] is not None:
+            yield waiting.popleft()
+        waiting.popleft()
+        yield analysis, context
+    while waiting:  # Cached questions after the last parsed one
+        yield waiting.popleft()
@@ -0,0 +1,170 @@
+#!/usr/bin/python3
+# This script turns result bindings into answers and keeps the result of every question
+# Authors: Jasper Bos (s3794687); Djim C. Casander (s3162753); Esther Ploeger (s3798461)
+# Date:    June 8th, 2021
+
+import json
+
+
+def plain_value(value):
+    return value['value']
+
+
+def coordinate_value(value):
+    """
+    :param value: value of a result binding (dict)
+    :return: the value if it has no language, e.g. Point(4.9 52.4), otherwise None (str)
+    """
+
+    return value['value'] if 'xml:lang' not in value else None
+
+
+def year_value(value):
+    """
+    :param value: value of a result binding (dict)
+    :return: year of a date without language, e.g. 1999-01-01T00:00:00Z, otherwise None (str)
+    """
+
+    return value['value'][:4] if 'xml:lang' not in value and len(value['value']) == 20 else None
+
+
+def month_value(value):
+    """
+    :param value: value of a result binding (dict)
+    :return: month of a date without language, otherwise None (str)
+    """
+
+    return value['value'][5:7] if 'xml:lang' not in value and len(value['value']) == 20 else None
+
+
+def choose_answer_filter(q):
+    """
+    Chooses once per question which values of the result bindings make up the answer
+    :param q: input question, plain text (str)
+    :return: function from the value of a binding to an answer, or None to skip the value
+    """
+
+    q = q.lower()
+    if 'coordinate' in q:
+        return coordinate_value
+    elif 'year' in q:
+        return year_value
+    elif 'month' in q:
+        return month_value
+    return plain_value
+
+
+def extract_answer(question_type, bindings, answer_filter=plain_value):
+    """
+    Turns the result bindings of one query into an answer
+    :param question_type: question type abbreviation (str)
+    :param bindings: result bindings of the query (list)
+    :param answer_filter: chosen with choose_answer_filter (function)
+    :return: answer to question (list or int), None if the next query should be tried
+    """
+
+    if not bindings:
+        return None
+    results = []
+    for item in bindings:
+        for value in item.values():
+            if value['value']:
+                answer = answer_filter(value)
+                if answer is not None:
+                    results.append(answer)
+    if not results:  # Nothing of the requested kind, e.g. only labels where a date was asked
+        return None
+    return len(results) if question_type == 'count' else results
+
+
+def format_answer(question_type, answer):
+    """
+    Formats an answer for the output file, with a fallback if there is no answer
+    :param question_type: question type abbreviation (str)
+    :param answer: answer to question (list or int)
+    :return: answer (str)
+    """
+
+    if answer:
+        if question_type == "yes/no":
+            return 'yes'
+        if isinstance(answer, int):
+            return str(answer)
+        return ','.join(dict.fromkeys(answer))  # Without duplicates, in the order of the results
+    else:
+        if question_type == "count":
+            return '12'
+        else:
+            return 'yes'
+
+
+class QuestionResult:
+    """
+    Everything that is known about one answered question: its type, the
+    candidate entities and properties, the entity and property that gave
+    the answer with their raw bindings, and the answer itself.
+    """
+
+    __slots__ = ('id', 'question', 'question_type', 'entities', 'properties', 'pair', 'bindings', 'answer')
+
+    def __init__(self, question, question_type='', entities=None, properties=None, id=None):
+        """
+        :param question: normalised question (str)
+        :param question_type: question type abbreviation (str)
+        :param entities: candidate entities, key: id and value: label (dict)
+        :param properties: candidate properties, key: id and value: label (dict)
+        :param id: ID of the question
+        """
+
+        self.id = id
+        self.question = question
+        self.question_type = question_type
+        self.entities = entities if entities is not None else dict()
+        self.properties = properties if properties is not None else dict()
+        self.pair = None  # (entity ID, property ID) that gave the answer
+        self.bindings = None  # Result bindings of that entity and property
+        self.answer = None  # List of values or a count, None if there is no answer
+
+    @classmethod
+    def from_dict(cls, record):
+        """
+        :param record: result written by to_dict (dict)
+        :return: result (QuestionResult)
+        """
+
+        result = cls(record['question'], record['question_type'], record['entities'], record['properties'],
+                     record.get('id'))
+        if record.get('entity') is not None:
+            result.pair = (record['entity'], record['property'])
+        result.bindings = record.get('bindings')
+        result.answer = record['answer']
+        return result
+
+    def text(self):
+        """
+        :return: answer for the output file (str)
+        """
+
+        return format_answer(self.question_type, self.answer)
+
+    def to_dict(self, bindings=False):
+        """
+        :param bindings: include the raw result bindings (bool)
+        :return: result (dict)
+        """
+
+        record = {'id': self.id,
+                  'question': self.question,
+                  'question_type': self.question_type,
+                  'entities': self.entities,
+                  'properties': self.properties,
+                  'entity': self.pair[0] if self.pair else None,
+                  'property': self.pair[1] if self.pair else None,
+                  'answer': self.answer,
+                  'answer_text': self.text()}
+        if bindings:
+            record['bindings'] = self.bindings
+        return record
+
+    def to_json(self, bindings=False):
+        return json.dumps(self.to_dict(bindings), ensure_ascii=False)
@@ -0,0 +1,144 @@
+#!/usr/bin/python3
+# This script answers many questions at the same time with an asyncio pipeline
+# Authors: Jasper Bos (s3794687); Djim C. Casander (s3162753); Esther Ploeger (s3798461)
+# Date:    June 8th, 2021
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from answer_cache import recall_or_analyse
+from answers import QuestionResult
+from metrics import metrics
+from system import get_question_type, get_entity_property_deps, get_entities_properties_libs, \
+    merge_results, answer_from_candidates, MAX_CONCURRENT_QUERIES
+
+CONCURRENCY = 16  # Questions in flight at the same time
+QUEUE_SIZE = 64  # Parsed questions waiting for the network stages
+
+_DONE = object()  # Marks the end of a queue
+
+
+async def answer_question_async(analysis, max_queries=MAX_CONCURRENT_QUERIES):
+    """
+    Answers one question, looking up the dependency and library candidates at the same time
+    :param analysis: analysis of the normalised question (QuestionAnalysis)
+    :param max_queries: maximum number of SPARQL queries in flight (int)
+    :return: result with question type, candidates and answer (QuestionResult)
+    """
+
+    with metrics.timer('answer_question'):  # The same stage as answer_question
+        q = analysis.text
+        question_type = get_question_type(analysis)
+        deps, libs = await asyncio.gather(
+            asyncio.to_thread(get_entity_property_deps, analysis, question_type),  # wbsearchentities
+            asyncio.to_thread(get_entities_properties_libs, q, analysis.linked_entities))  # Falcon
+        ents, props = merge_results(deps, libs)
+        return await asyncio.to_thread(answer_from_candidates, analysis, question_type, ents, props, max_queries)
+
+
+async def _parse(questions, parsed, slots, batch_size, n_process):
+    """
+    CPU stage: parses the questions in a single thread and queues their analyses
+    :param questions: iterable of (question, ID) tuples
+    :param parsed: queue of (position, analysis or cached result, ID) tuples (asyncio.Queue)
+    :param slots: limits the number of questions between parsing and writing (asyncio.Semaphore)
+    :param batch_size: number of questions spacy parses per batch (int)
+    :param n_process: number of processes used for parsing (int)
+    """
+
+    loop = asyncio.get_running_loop()
+    analyses = recall_or_analyse(questions, batch_size, n_process)  # Cached questions are not parsed
+    with ThreadPoolExecutor(max_workers=1) as cpu:  # spacy pipes are not advanced from several threads
+        position = 0
+        while True:
+            await slots.acquire()
+            item = await loop.run_in_executor(cpu, next, analyses, _DONE)
+            if item is _DONE:
+                slots.release()
+                break
+            analysis, id = item
+            await parsed.put((position, analysis, id))
+            position += 1
+
+
+async def _answer(parsed, answered, max_queries):
+    """
+    I/O stage: answers parsed questions until the parse stage is done
+    :param parsed: queue of (position, analysis or cached result, ID) tuples (asyncio.Queue)
+    :param answered: queue of (position, result) tuples (asyncio.Queue)
+    :param max_queries: maximum number of SPARQL queries in flight per question (int)
+    """
+
+    while True:
+        item = await parsed.get()
+        if item is _DONE:
+            break
+        position, analysis, id = item
+        if isinstance(analysis, QuestionResult):  # From the answer cache
+            result = analysis
+        else:
+            result = await answer_question_async(analysis, max_queries)
+        result.id = id
+        await answered.put((position, result))
+
+
+async def _write(answered, slots, on_answer):
+    """
+    Passes the answers on in input order, holding back answers that finished early
+    :param answered: queue of (position, result) tuples (asyncio.Queue)
+    :param slots: limits the number of questions between parsing and writing (asyncio.Semaphore)
+    :param on_answer: called with the result of every question (function)
+    """
+
+    waiting = dict()  # key: position and value: result
+    next_position = 0
+    while True:
+        item = await answered.get()
+        if item is _DONE:
+            break
+        position, result = item
+        waiting[position] = result
+        while next_position in waiting:
+            on_answer(waiting.pop(next_position))
+            next_position += 1
+            slots.release()
+
+
+async def run_pipeline(questions, on_answer, concurrency=CONCURRENCY, batch_size=64, n_process=1,
+                       max_queries=MAX_CONCURRENT_QUERIES):
+    """
+    Answers questions with many of them in flight, passing the answers on in input order
+    :param questions: iterable of (normalised question, ID) tuples
+    :param on_answer: called with the result of every question (function)
+    :param concurrency: number of questions answered at the same time (int)
+    :param batch_size: number of questions spacy parses per batch (int)
+    :param n_process: number of processes used for parsing (int)
+    :param max_queries: maximum number of SPARQL queries in flight per question (int)
+    """
+
+    loop = asyncio.get_running_loop()
+    # Every question uses up to two threads at the same time: dependency search and Falcon
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=2 * concurrency))
+
+    parsed = asyncio.Queue(maxsize=QUEUE_SIZE)
+    answered = asyncio.Queue()
+    slots = asyncio.Semaphore(QUEUE_SIZE + concurrency)  # Bounds the questions held in the reorder buffer
+
+    async def feed():
+        await _parse(questions, parsed, slots, batch_size, n_process)
+        for _ in workers:
+            await parsed.put(_DONE)
+        await asyncio.gather(*workers)
+        await answered.put(_DONE)
+
+    writer = asyncio.create_task(_write(answered, slots, on_answer))
+    workers = [asyncio.create_task(_answer(parsed, answered, max_queries)) for _ in range(concurrency)]
+    tasks = [asyncio.create_task(feed()), writer] + workers
+    try:
+        # A failed question stops the pipeline, the other stages would wait for it forever
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+        for task in done:
+            if not task.cancelled() and task.exception() is not None:
+                raise task.exception()
+    finally:
+        for task in tasks:
+            task.cancel()
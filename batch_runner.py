@@ -0,0 +1,193 @@
+#!/usr/bin/python3
+# This script answers a question file with several worker processes, one shard of the questions at a time
+# Authors: Jasper Bos (s3794687); Djim C. Casander (s3162753); Esther Ploeger (s3798461)
+# Date:    June 8th, 2021
+
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, FIRST_EXCEPTION, wait
+import http_client
+import kb_cache
+from models import get_nlp
+from question_io import read_questions, AnswerWriter
+from system import normalise_question, answer_questions, add_config_arguments, configure
+
+PROGRESS_EVERY = 0.5  # Seconds between progress reports
+
+# State of a worker process, set by _init_worker
+_args = None
+_progress = None
+
+
+def split_shards(questions, shards):
+    """
+    Splits the questions into consecutive shards of about the same size
+    :param questions: list of (ID, question) tuples
+    :param shards: number of shards (int)
+    :return: list of shards (lists of (ID, question) tuples), without empty shards
+    """
+
+    size, rest = divmod(len(questions), shards)
+    result = []
+    start = 0
+    for i in range(shards):
+        end = start + size + (1 if i < rest else 0)
+        if end > start:
+            result.append(questions[start:end])
+        start = end
+    return result
+
+
+def _init_worker(args, buckets, progress):
+    """
+    Loads the models and opens the HTTP session of a worker process, once
+    :param args: parsed options of add_config_arguments (argparse.Namespace)
+    :param buckets: rate limits shared by all workers, key: host (dict)
+    :param progress: queue of (shard, answered questions) tuples (multiprocessing.Queue)
+    """
+
+    global _args, _progress
+    _args = args
+    _progress = progress
+    configure(args)
+    http_client.get_client().buckets.update(buckets)
+    get_nlp(entity_linker=True)  # Warm before the first shard
+
+
+def run_shard(index, questions, path):
+    """
+    Answers one shard in a worker process
+    :param index: position of the shard (int)
+    :param questions: list of (ID, question) tuples
+    :param path: path to write the results of the shard to, as JSONL (str)
+    :return: position of the shard (int)
+    """
+
+    with AnswerWriter(path, 'jsonl') as writer:
+
+        def on_answer(result):
+            writer.write(result.id, result.text(), result.to_dict(_args.bindings))
+            _progress.put((index, 1))
+
+        normalised = ((normalise_question(q), id) for id, q in questions)
+        answer_questions(normalised, on_answer, _args.concurrency, _args.batch_size, 1, _args.max_queries)
+    if _args.kb_hot_set:  # Merged into the hot set by run_batch
+        kb_cache.save_hot_set(hot_set_path(path))
+    return index
+
+
+def hot_set_path(path):
+    """
+    :param path: path to the JSONL file of a shard (str)
+    :return: path to the hot set of the worker that answered the shard (str)
+    """
+
+    return path + '.kb_hot_set.json'
+
+
+def print_progress(answered, sizes, file=sys.stderr):
+    """
+    :param answered: answered questions per shard (list of int)
+    :param sizes: questions per shard (list of int)
+    """
+
+    shards = ", ".join("{}/{}".format(done, size) for done, size in zip(answered, sizes))
+    file.write("\r" + "Answered {}/{} questions (shards: {})".format(sum(answered), sum(sizes), shards))
+    file.flush()
+
+
+def merge_shards(paths, writer):
+    """
+    Writes the results of all shards to one output, in the order of the shards
+    :param paths: paths to the JSONL files of the shards, in input order (list)
+    :param writer: output (AnswerWriter)
+    :return: number of answers written (int)
+    """
+
+    written = 0
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                record = json.loads(line)
+                writer.write(record['id'], record['answer_text'], record)
+                written += 1
+    return written
+
+
+def run_batch(questions, writer, args, workers, shards=None):
+    """
+    Answers questions in worker processes and writes the answers in input order
+    :param questions: list of (ID, question) tuples
+    :param writer: output (AnswerWriter)
+    :param args: parsed options of add_config_arguments (argparse.Namespace)
+    :param workers: number of worker processes (int)
+    :param shards: number of shards, one per worker if None (int)
+    :return: number of answers written (int)
+    """
+
+    shard_list = split_shards(questions, shards or workers)
+    sizes = [len(shard) for shard in shard_list]
+    context = multiprocessing.get_context()
+    progress = context.Queue()
+    buckets = http_client.shared_buckets(context=context)
+
+    with tempfile.TemporaryDirectory(prefix='batch_runner_') as tmpdir:
+        paths = [os.path.join(tmpdir, 'shard-{}.jsonl'.format(i)) for i in range(len(shard_list))]
+        with ProcessPoolExecutor(max_workers=min(workers, len(shard_list)) or 1, mp_context=context,
+                                 initializer=_init_worker, initargs=(args, buckets, progress)) as pool:
+            futures = [pool.submit(run_shard, i, shard, path) for i, (shard, path) in
+                       enumerate(zip(shard_list, paths))]
+            answered = [0] * len(shard_list)
+            pending = set(futures)
+            while pending:
+                done, pending = wait(pending, timeout=PROGRESS_EVERY, return_when=FIRST_EXCEPTION)
+                for future in done:
+                    if future.exception() is not None:  # Stop the shards that have not started
+                        for other in pending:
+                            other.cancel()
+                        raise future.exception()
+                try:
+                    while True:
+                        index, count = progress.get_nowait()
+                        answered[index] += count
+                except queue.Empty:
+                    pass
+                print_progress(answered, sizes)
+        sys.stderr.write("\n")
+        if args.kb_hot_set:
+            kb_cache.merge_hot_sets([hot_set_path(path) for path in paths], args.kb_hot_set, args.kb_cache_size)
+        return merge_shards(paths, writer)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='answer a question file with several worker processes')
+    parser.add_argument('questionfile', help='path to file with all questions, tab separated or .jsonl, - for stdin')
+    parser.add_argument('outfile', help='path to file to write to, tab separated or .jsonl, - for stdout')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='number of worker processes, each with its own models and HTTP session')
+    parser.add_argument('--shards', type=int, help='number of shards the questions are split into, '
+                                                   'more shards than workers balance slow shards')
+    parser.add_argument('--input-format', choices=['tsv', 'jsonl'], help='format of the question file')
+    parser.add_argument('--output-format', choices=['tsv', 'jsonl'], help='format of the output file')
+    parser.add_argument('--encoding', help='encoding of input and output, UTF-16 for tsv and UTF-8 for jsonl')
+    parser.add_argument('--bindings', action='store_true',
+                        help='also write the result bindings of the answer to JSONL output')
+    add_config_arguments(parser)
+    args = parser.parse_args()
+    if args.n_process != 1:  # Every worker parses its shards itself, the workers are the processes
+        parser.error('--n-process is not supported by the batch runner, use --workers')
+
+    questions = list(read_questions(args.questionfile, args.input_format, args.encoding))
+    with AnswerWriter(args.outfile, args.output_format, args.encoding) as writer:
+        written = run_batch(questions, writer, args, args.workers, args.shards)
+    print("Answered {} questions".format(written), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+#!/usr/bin/python3
+# This script measures the speed and accuracy of the system on recorded responses, without network access
+# Authors: Jasper Bos (s3794687); Djim C. Casander (s3162753); Esther Ploeger (s3798461)
+# Date:    June 8th, 2021
+
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+import http_client
+from cache import cache_key
+from metrics import metrics
+from question_io import read_questions, AnswerWriter
+from system import normalise_question, answer_questions, add_config_arguments, configure, \
+    write_metrics
+
+FIXTURES_PATH = 'fixtures.jsonl'
+
+
+class RecordedResponse:
+    """
+    Response read from a fixture file, with the attributes of a requests response that the client uses.
+    """
+
+    def __init__(self, status_code, text):
+        self.status_code = status_code
+        self.content = text.encode('utf-8')
+        self.headers = dict()
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class FixtureTransport:
+    """
+    Replaces the network of the HTTP client: replays recorded responses of
+    Falcon, wbsearchentities and SPARQL after an injected delay, or records
+    the responses of the real endpoints. Responses are found by the same key
+    as the response cache, so a recorded request is replayed whatever its
+    parameter order.
+    """
+
+    def __init__(self, path=FIXTURES_PATH, record=False, latency=0.0, jitter=0.0):
+        """
+        :param path: path to the JSONL fixture file (str)
+        :param record: send requests to the real endpoints and add their responses to the file (bool)
+        :param latency: seconds every replayed response is delayed (float)
+        :param jitter: extra random delay of up to this many seconds (float)
+        """
+
+        self.path = path
+        self.record = record
+        self.latency = latency
+        self.jitter = jitter
+        self.fixtures = dict()  # key: cache key and value: (status, body)
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        fixture = json.loads(line)
+                        self.fixtures[fixture['key']] = (fixture['status'], fixture['body'])
+        self.live = http_client.HttpClient() if record else None  # Sends the requests that are recorded
+
+    def send(self, method, url, params, data, headers):
+        key = cache_key(method, url, params, data)
+        fixture = self.fixtures.get(key)
+        if fixture is None and self.record:
+            response = self.live._send(self.live.session(urlsplit(url).netloc), method, url, params, data, headers)
+            fixture = (response.status_code, response.text)
+            if response.status_code not in http_client.RETRY_STATUS:
+                self._save(key, method, url, params, data, fixture)
+            return RecordedResponse(*fixture)
+
+        if self.latency or self.jitter:
+            time.sleep(self.latency + random.uniform(0, self.jitter))
+        if fixture is None:
+            metrics.inc('fixture_misses', host=urlsplit(url).netloc)
+            return RecordedResponse(404, '')  # Not retried, answered as a failed request
+        metrics.inc('fixture_hits', host=urlsplit(url).netloc)
+        return RecordedResponse(*fixture)
+
+    def _save(self, key, method, url, params, data, fixture):
+        if isinstance(data, bytes):
+            data = data.decode('utf-8')
+        with self._lock:
+            self.fixtures[key] = fixture
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps({'key': key, 'method': method, 'url': url, 'params': params, 'data': data,
+                                    'status': fixture[0], 'body': fixture[1]}, ensure_ascii=False) + '\n')
+
+
+def split_answer(answer):
+    """
+    :param answer: formatted answer, values separated by commas (str)
+    :return: normalised values (set)
+    """
+
+    return {value.strip().lower() for value in answer.split(',') if value.strip()}
+
+
+def read_gold(path, encoding='utf-8'):
+    """
+    Reads the correct answers, in the format of the output files
+    :param path: path to a tab separated file of IDs and answers (str)
+    :param encoding: encoding of the file (str)
+    :return: key: ID and value: normalised values (dict)
+    """
+
+    return {id: split_answer(answer) for id, answer in read_questions(path, 'tsv', encoding)}
+
+
+def score(answers, gold):
+    """
+    Compares the answers with the correct answers
+    :param answers: key: ID and value: formatted answer (dict)
+    :param gold: key: ID and value: normalised values (dict)
+    :return: number of questions scored, accuracy and mean F1 (dict)
+    """
+
+    correct = 0
+    f1_sum = 0.0
+    ids = [id for id in answers if id in gold]
+    for id in ids:
+        predicted = split_answer(answers[id])
+        if predicted == gold[id]:
+            correct += 1
+        overlap = len(predicted & gold[id])
+        if overlap:
+            precision = overlap / len(predicted)
+            recall = overlap / len(gold[id])
+            f1_sum += 2 * precision * recall / (precision + recall)
+    return {'scored': len(ids),
+            'accuracy': correct / len(ids) if ids else None,
+            'f1': f1_sum / len(ids) if ids else None}
+
+
+def run(questions, concurrency=1, batch_size=64, n_process=1, max_queries=8):
+    """
+    Answers all questions and measures the run
+    :param questions: list of (ID, question) tuples
+    :param concurrency: number of questions answered at the same time (int)
+    :param batch_size: number of questions spacy parses per batch (int)
+    :param n_process: number of processes used for parsing (int)
+    :param max_queries: maximum number of SPARQL queries in flight per question (int)
+    :return: key: ID and value: formatted answer (dict) and seconds the run took (float)
+    """
+
+    answers = dict()
+    started = dict()  # key: ID and value: time the question was read
+
+    def read():
+        for id, q in questions:
+            started[id] = time.perf_counter()
+            yield normalise_question(q), id
+
+    def on_answer(result):
+        # End to end, parsing and waiting in the pipeline included
+        metrics.observe('question', time.perf_counter() - started.pop(result.id))
+        answers[result.id] = result.text()
+
+    start = time.perf_counter()
+    answer_questions(read(), on_answer, concurrency, batch_size, n_process, max_queries)
+    return answers, time.perf_counter() - start
+
+
+def report(questions, seconds, summary, accuracy=None):
+    """
+    :param questions: number of answered questions (int)
+    :param seconds: seconds the run took (float)
+    :param summary: stage latencies and counters (dict)
+    :param accuracy: scores against the gold file (dict)
+    :return: benchmark report (dict)
+    """
+
+    latency = summary['stages'].get('question', dict())  # From reading a question to writing its answer
+    return {'questions': questions,
+            'seconds': seconds,
+            'throughput': questions / seconds if seconds else None,
+            'latency': {p: latency.get(p) for p in ('mean', 'p50', 'p95', 'p99', 'max')},
+            'stages': {stage: {'count': stage_summary['count'], 'sum': stage_summary['sum'],
+                               'p50': stage_summary['p50'], 'p95': stage_summary['p95']}
+                       for stage, stage_summary in summary['stages'].items()},
+            'counters': summary['counters'],
+            'accuracy': accuracy}
+
+
+def print_report(result, file=sys.stderr):
+    print("Questions:  {}".format(result['questions']), file=file)
+    print("Time:       {:.2f} s".format(result['seconds']), file=file)
+    print("Throughput: {:.2f} questions/s".format(result['throughput'] or 0), file=file)
+    latency = result['latency']
+    if latency['p50'] is not None:
+        print("Latency:    p50 {:.3f} s, p95 {:.3f} s, p99 {:.3f} s".format(
+            latency['p50'], latency['p95'], latency['p99']), file=file)
+    print("Stages:", file=file)
+    for stage, stage_summary in sorted(result['stages'].items(), key=lambda item: -item[1]['sum']):
+        print("  {:<28} {:>6} calls {:>9.3f} s total {:>8.4f} s p50".format(
+            stage, stage_summary['count'], stage_summary['sum'], stage_summary['p50']), file=file)
+    if result['accuracy'] is not None:
+        accuracy = result['accuracy']
+        print("Accuracy:   {:.3f} exact, {:.3f} F1 over {} questions".format(
+            accuracy['accuracy'] or 0, accuracy['f1'] or 0, accuracy['scored']), file=file)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='measure speed and accuracy on recorded endpoint responses')
+    parser.add_argument('questionfile', help='path to file with all questions, tab separated or .jsonl')
+    parser.add_argument('--fixtures', default=FIXTURES_PATH, help='path to the recorded responses')
+    parser.add_argument('--record', action='store_true',
+                        help='send unrecorded requests to the real endpoints and record their responses')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds every replayed response is delayed')
+    parser.add_argument('--jitter', type=float, default=0.0, help='extra random delay of up to this many seconds')
+    parser.add_argument('--gold', help='path to the correct answers, tab separated like the output')
+    parser.add_argument('--gold-encoding', default='utf-8', help='encoding of the gold file')
+    parser.add_argument('--encoding', help='encoding of the question file, UTF-16 for tsv and UTF-8 for jsonl')
+    parser.add_argument('--limit', type=int, help='only answer the first questions')
+    parser.add_argument('--answers', help='write the answers to this file')
+    parser.add_argument('--report', help='write the report to this file as json')
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    args.no_cache = True  # Every request goes through the fixtures
+    configure(args)
+    http_client.get_client().transport = FixtureTransport(args.fixtures, args.record, args.latency, args.jitter)
+    metrics.keep_samples = True  # Exact percentiles
+
+    questions = list(read_questions(args.questionfile, encoding=args.encoding))[:args.limit]
+    answers, seconds = run(questions, args.concurrency, args.batch_size, args.n_process, args.max_queries)
+
+    if args.answers:
+        with AnswerWriter(args.answers) as writer:
+            for id, _ in questions:
+                writer.write(id, answers[id])
+    accuracy = score(answers, read_gold(args.gold, args.gold_encoding)) if args.gold else None
+    result = report(len(answers), seconds, metrics.to_dict(), accuracy)
+    print_report(result)
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2)
+    if args.metrics:
+        write_metrics(args.metrics)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+#!/usr/bin/python3
+# This script keeps a persistent cache of the responses of Wikidata, SPARQL and Falcon
+# Authors: Jasper Bos (s3794687); Djim C. Casander (s3162753); Esther Ploeger (s3798461)
+# Date:    June 8th, 2021
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from http_client import get_client
+from metrics import metrics
+
+CACHE_PATH = '.lt_cache.sqlite'
+CACHE_TTL = 7 * 24 * 60 * 60  # One week, in seconds
+CACHE_MAX_ENTRIES = 500000
+EVICT_EVERY = 100  # Check the size of the cache every n writes
+
+
+class ResponseCache:
+    """
+    Response cache stored in SQLite, with a time to live per entry and
+    least recently used eviction once the cache holds too many entries.
+    """
+
+    def __init__(self, path=CACHE_PATH, ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES, offline=False,
+                 name='response_cache'):
+        """
+        :param path: path to the SQLite file (str)
+        :param ttl: seconds an entry stays valid, None to keep entries forever (int)
+        :param max_entries: maximum number of entries before the least recently used are evicted (int)
+        :param offline: only serve from the cache, never send requests, expired entries included (bool)
+        :param name: name of the hit and miss counter in the metrics (str)
+        """
+
+        self.path = path
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.offline = offline
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')  # Readers do not block the writer
+        self._conn.execute('CREATE TABLE IF NOT EXISTS responses '
+                           '(key TEXT PRIMARY KEY, value TEXT, created REAL, accessed REAL)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)')
+
+    def get(self, key):
+        """
+        Looks up a response
+        :param key: cache key (str)
+        :return: cached response (json), None if missing or expired
+        """
+
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute('SELECT value, created FROM responses WHERE key = ?', (key,)).fetchone()
+            # Offline, an expired entry is still better than no response at all
+            expired = row is not None and self.ttl is not None and not self.offline and now - row[1] > self.ttl
+            if row is None or expired:
+                self.misses += 1
+                metrics.inc(self.name, result='miss')
+                return None
+            self._conn.execute('UPDATE responses SET accessed = ? WHERE key = ?', (now, key))
+            self.hits += 1
+            metrics.inc(self.name, result='hit')
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        """
+        Stores a response
+        :param key: cache key (str)
+        :param value: response (json)
+        """
+
+        now = time.time()
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)',
+                               (key, json.dumps(value), now, now))
+            self._writes += 1
+            if self._writes % EVICT_EVERY == 0:
+                self._evict(now)
+
+    def _evict(self, now):
+        """
+        Removes expired entries and the least recently used entries over the size limit
+        :param now: current time (float)
+        """
+
+        if self.ttl is not None:
+            self._conn.execute('DELETE FROM responses WHERE created < ?', (now - self.ttl,))
+        size = self._conn.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+        if size > self.max_entries:
+            self._conn.execute('DELETE FROM responses WHERE key IN '
+                               '(SELECT key FROM responses ORDER BY accessed LIMIT ?)', (size - self.max_entries,))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_cache = None  # Shared cache, None means every request is sent
+
+
+def configure(path=CACHE_PATH, ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES, offline=False):
+    """
+    Enables the shared response cache
+    :param path: path to the SQLite file (str)
+    :param ttl: seconds an entry stays valid, None to keep entries forever (int)
+    :param max_entries: maximum number of entries (int)
+    :param offline: only serve from the cache, never send requests, expired entries included (bool)
+    :return: the shared cache (ResponseCache)
+    """
+
+    global _cache
+    if _cache is not None:
+        _cache.close()
+    _cache = ResponseCache(path, ttl, max_entries, offline)
+    return _cache
+
+
+def get_cache():
+    return _cache
+
+
+def _normalise(value):
+    if isinstance(value, bytes):
+        value = value.decode('utf-8')
+    if isinstance(value, str):
+        return " ".join(value.split())  # Collapse whitespace
+    return value
+
+
+def cache_key(method, url, params=None, data=None):
+    """
+    Builds a cache key from the normalised request
+    :param method: HTTP method (str)
+    :param url: URL of the endpoint (str)
+    :param params: query parameters (dict)
+    :param data: request body (str or bytes)
+    :return: cache key (str)
+    """
+
+    params = sorted((key, _normalise(value)) for key, value in (params or dict()).items())
+    request = json.dumps([method.upper(), url, params, _normalise(data)], ensure_ascii=False)
+    return hashlib.sha256(request.encode('utf-8')).hexdigest()
+
+
+def fetch_json(method, url, params=None, data=None, headers=None):
+    """
+    Sends a request and returns its json response, served from the shared cache when possible
+    :param method: HTTP method (str)
+    :param url: URL of the endpoint (str)
+    :param params: query parameters (dict)
+    :param data: request body (str or bytes)
+    :param headers: request headers (dict)
+    :return: response (json), None if the request failed or the cache is offline and has no entry
+    """
+
+    key = None
+    if _cache is not None:
+        key = cache_key(method, url, params, data)
+        value = _cache.get(key)
+        if value is not None:
+            return value
+        if _cache.offline:
+            return None
+
+    value = get_client().request_json(method, url, params, data, headers)
+    if value is not None and key is not None:
+        _cache.set(key, value)
+    return value
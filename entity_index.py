@@ -0,0 +1,203 @@
+#!/usr/bin/python3
+# This script finds Wikidata entities in a local index of their labels and aliases
+# Authors: Jasper Bos (s3794687); Djim C. Casander (s3162753); Esther Ploeger (s3798461)
+# Date:    June 8th, 2021
+
+import argparse
+import difflib
+import os
+import re
+import sys
+import tempfile
+from property_index import ARTICLES
+from sorted_table import SortedTable, write_sorted, clean
+from triple_store import read_dump
+
+# Files of an index directory
+KEYS_FILE = 'keys.tsv'  # normalised label or alias, rank and entity ID, sorted by key and rank
+LABELS_FILE = 'labels.tsv'  # entity ID and English label
+
+MAX_SITELINKS = 999999  # The rank column is MAX_SITELINKS minus the sitelinks, so popular entities sort first
+PREFIX_SCAN = 200  # Keys read at most for a prefix match
+FUZZY_SCAN = 2000  # Keys read at most for a fuzzy match
+FUZZY_THRESHOLD = 0.85  # Minimal similarity of a fuzzy match
+NON_WORD = re.compile(r'[^\w\s]')
+
+
+def normalise_name(name):
+    """
+    Normalises an entity name for lookup
+    :param name: entity name (str)
+    :return: lowercased name without punctuation and articles, with single spaces (str)
+    """
+
+    return " ".join(word for word in NON_WORD.sub(' ', name.lower()).split() if word not in ARTICLES)
+
+
+class EntityIndex:
+    """
+    Memory-mapped index of the English labels and aliases of Wikidata
+    entities. Names are matched exactly, then on the start of a longer name
+    and then on similar spelling; candidates are ranked by the number of
+    sitelinks, so that the best known entity with a name comes first.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: path to the index directory (str)
+        """
+
+        self.keys = SortedTable(os.path.join(path, KEYS_FILE))
+        self.labels = SortedTable(os.path.join(path, LABELS_FILE))
+
+    def close(self):
+        self.keys.close()
+        self.labels.close()
+
+    def label(self, entity_id):
+        columns = self.labels.get(entity_id)
+        return columns[0] if columns else None
+
+    def _scan(self, prefix, limit):
+        """
+        :param prefix: start of the normalised keys (str)
+        :param limit: maximum number of keys read (int)
+        :return: list of (key, sitelinks, entity ID) tuples
+        """
+
+        candidates = []
+        for key, rank, entity_id in self.keys.iter_prefix(prefix):
+            candidates.append((key, MAX_SITELINKS - int(rank), entity_id))
+            if len(candidates) >= limit:
+                break
+        return candidates
+
+    def candidates(self, name, limit=1, fuzzy=True):
+        """
+        Finds the entities with a name
+        :param name: entity name (str)
+        :param limit: maximum number of entities (int)
+        :param fuzzy: fall back on prefix and similar spelling if there is no exact match (bool)
+        :return: list of (entity ID, score) tuples, best first
+        """
+
+        key = normalise_name(name)
+        if not key:
+            return []
+        scored = [(1.0, sitelinks, entity_id) for _, sitelinks, entity_id in self._scan(key + '\t', PREFIX_SCAN)]
+        if not scored and fuzzy:  # e.g. 'godfather' for 'the godfather part ii'
+            scored = [(len(key) / len(candidate), sitelinks, entity_id)
+                      for candidate, sitelinks, entity_id in self._scan(key + ' ', PREFIX_SCAN)]
+        if not scored and fuzzy and len(key) > 3:  # Misspellings, matched among the keys that start the same
+            matcher = difflib.SequenceMatcher(b=key, autojunk=False)
+            for candidate, sitelinks, entity_id in self._scan(key[:3], FUZZY_SCAN):
+                matcher.set_seq1(candidate)
+                if matcher.real_quick_ratio() >= FUZZY_THRESHOLD and matcher.quick_ratio() >= FUZZY_THRESHOLD:
+                    score = matcher.ratio()
+                    if score >= FUZZY_THRESHOLD:
+                        scored.append((score, sitelinks, entity_id))
+
+        ranked = dict()  # key: entity ID and value: score, best known entities first
+        for score, sitelinks, entity_id in sorted(scored, key=lambda item: (-item[1], -item[0])):
+            ranked.setdefault(entity_id, score)
+        return list(ranked.items())[:limit]
+
+    def lookup(self, name, limit=1, fuzzy=True):
+        """
+        Finds the entities with a name
+        :param name: entity name (str)
+        :param limit: maximum number of entities (int)
+        :param fuzzy: fall back on prefix and similar spelling if there is no exact match (bool)
+        :return: dictionary with key: id and value: label, empty if there is no match
+        """
+
+        return {entity_id: self.label(entity_id) or entity_id
+                for entity_id, _ in self.candidates(name, limit, fuzzy)}
+
+
+def build_entity_index(dumpfile, outdir):
+    """
+    Builds an index of the labels and aliases of a filtered Wikidata dump
+    :param dumpfile: path to the JSON dump (str)
+    :param outdir: directory to write the index to (str)
+    """
+
+    os.makedirs(outdir, exist_ok=True)
+    unsorted = {name: tempfile.TemporaryFile('w+', encoding='utf-8', newline='\n')
+                for name in (KEYS_FILE, LABELS_FILE)}
+    entities = 0
+    for entity in read_dump(dumpfile):
+        entity_id = entity['id']
+        label = entity.get('labels', {}).get('en')
+        aliases = [alias['value'] for alias in entity.get('aliases', {}).get('en', [])]
+        names = ([label['value']] if label else []) + aliases
+        if not names:
+            continue
+        rank = '{:06d}'.format(MAX_SITELINKS - min(len(entity.get('sitelinks', {})), MAX_SITELINKS))
+        for key in dict.fromkeys(normalise_name(name) for name in names):
+            if key:
+                unsorted[KEYS_FILE].write(key + '\t' + rank + '\t' + entity_id + '\n')
+        unsorted[LABELS_FILE].write(entity_id + '\t' + clean(names[0]) + '\n')
+        entities += 1
+
+    for name, f in unsorted.items():
+        with f:
+            f.seek(0)
+            write_sorted((line.rstrip('\n') for line in f), os.path.join(outdir, name))
+    print("Indexed {} entities".format(entities), file=sys.stderr)
+
+
+_index = None
+_index_path = None
+
+
+def configure(path=None):
+    """
+    Sets the index directory used to find entities, None only uses the Wikidata search
+    :param path: path to the index directory (str)
+    """
+
+    global _index, _index_path
+    if _index is not None:
+        _index.close()
+    _index = None
+    _index_path = path
+
+
+def get_entity_index():
+    """
+    Returns the shared entity index, opening it on first use
+    :return: entity index (EntityIndex), None if no index is configured
+    """
+
+    global _index
+    if _index is None and _index_path and os.path.isdir(_index_path):
+        _index = EntityIndex(_index_path)
+    return _index
+
+
+def lookup_entity(name, limit=1):
+    """
+    Finds an entity in the shared index
+    :param name: entity name (str)
+    :param limit: maximum number of entities (int)
+    :return: dictionary with key: id and value: label, empty if there is no match or no index
+    """
+
+    index = get_entity_index()
+    if index is None:
+        return dict()
+    return index.lookup(name, limit)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='build the local index of Wikidata entity labels')
+    parser.add_argument('dumpfile', help='path to the filtered JSON dump, may be gzipped or bzipped')
+    parser.add_argument('outdir', help='directory to write the index to')
+    args = parser.parse_args()
+    build_entity_index(args.dumpfile, args.outdir)
+
+
+if __name__ == "__main__":
+    main()
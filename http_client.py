@@ -0,0 +1,328 @@
+#!/usr/bin/python3
+# This script sends all HTTP requests of the system, with timeouts, retries and rate limits
+# Authors: Jasper Bos (s3794687); Djim C. Casander (s3162753); Esther Ploeger (s3798461)
+# Date:    June 8th, 2021
+
+import multiprocessing
+import random
+import sys
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from metrics import metrics
+
+try:  # HTTP/2 is optional, it needs httpx with h2
+    import h2  # noqa: F401
+    import httpx
+except ImportError:
+    httpx = None
+
+TIMEOUT = (5, 65)  # Seconds to connect and to read, the SPARQL endpoint times out queries after 60 seconds
+MAX_RETRIES = 4
+BACKOFF = 0.5  # Seconds to wait before the first retry, doubled every retry
+MAX_BACKOFF = 30
+MAX_RETRY_AFTER = 120  # Longest Retry-After a server may ask for, a request is given up after longer ones
+POOL_SIZE = 10  # Keep-alive connections per host
+RETRY_STATUS = {429, 502, 503, 504}  # A 500 is not retried, the SPARQL endpoint uses it for query timeouts
+
+# Requests per second and burst size per host
+RATE_LIMITS = {'query.wikidata.org': (5, 10),
+               'www.wikidata.org': (10, 20),
+               'labs.tib.eu': (5, 10)}
+
+TRANSPORT_ERRORS = (requests.ConnectionError, requests.Timeout)
+if httpx is not None:
+    TRANSPORT_ERRORS += (httpx.TransportError,)
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter, every request takes one token and tokens
+    are added at a fixed rate up to the size of the bucket.
+    """
+
+    def __init__(self, rate, capacity):
+        """
+        :param rate: tokens added per second (float)
+        :param capacity: maximum number of tokens (int)
+        """
+
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Takes a token, waits until one is available
+        """
+
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class SharedTokenBucket(TokenBucket):
+    """
+    Token bucket kept in shared memory, so that worker processes started
+    after it was created share one rate limit.
+    """
+
+    def __init__(self, rate, capacity, context=multiprocessing):
+        """
+        :param rate: tokens added per second (float)
+        :param capacity: maximum number of tokens (int)
+        :param context: multiprocessing context of the workers
+        """
+
+        self.rate = rate
+        self.capacity = capacity
+        self._state = context.Array('d', [capacity, time.monotonic()])  # Tokens and last update, with a lock
+
+    def acquire(self):
+        """
+        Takes a token, waits until one is available
+        """
+
+        while True:
+            with self._state.get_lock():
+                now = time.monotonic()
+                tokens = min(self.capacity, self._state[0] + (now - self._state[1]) * self.rate)
+                self._state[1] = now
+                if tokens >= 1:
+                    self._state[0] = tokens - 1
+                    return
+                self._state[0] = tokens
+                wait = (1 - tokens) / self.rate
+            time.sleep(wait)
+
+
+def shared_buckets(rate_limits=None, context=multiprocessing):
+    """
+    Creates the rate limits of all hosts in shared memory, before the worker processes are started
+    :param rate_limits: dict where key: host and value: (requests per second, burst size)
+    :param context: multiprocessing context of the workers
+    :return: dict where key: host and value: rate limiter (SharedTokenBucket)
+    """
+
+    return {host: SharedTokenBucket(rate, capacity, context)
+            for host, (rate, capacity) in (RATE_LIMITS if rate_limits is None else rate_limits).items()}
+
+
+def retry_after(response):
+    """
+    Reads the Retry-After header of a response
+    :param response: HTTP response
+    :return: seconds to wait (float), None if there is no valid header
+    """
+
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+
+class HttpClient:
+    """
+    HTTP client with a pooled keep-alive session and a rate limit per host,
+    and bounded retries with exponential backoff and jitter.
+    """
+
+    def __init__(self, timeout=TIMEOUT, max_retries=MAX_RETRIES, backoff=BACKOFF, max_backoff=MAX_BACKOFF,
+                 rate_limits=None, pool_size=POOL_SIZE, pool_sizes=None, http2=False, transport=None,
+                 max_retry_after=MAX_RETRY_AFTER):
+        """
+        :param timeout: seconds to connect and to read (tuple)
+        :param max_retries: maximum number of retries per request, of any kind (int)
+        :param backoff: seconds to wait before the first retry (float)
+        :param max_backoff: maximum seconds to wait between retries without a Retry-After header (float)
+        :param rate_limits: dict where key: host and value: (requests per second, burst size)
+        :param pool_size: keep-alive connections per host (int)
+        :param pool_sizes: dict where key: host and value: keep-alive connections, overrides pool_size
+        :param http2: use HTTP/2 if httpx and h2 are installed (bool)
+        :param transport: object whose send(method, url, params, data, headers) replaces the network,
+                          e.g. to replay recorded responses
+        :param max_retry_after: maximum seconds a server may ask to wait before a retry (float)
+        """
+
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_retry_after = max_retry_after
+        self.buckets = {host: TokenBucket(rate, capacity)
+                        for host, (rate, capacity) in (RATE_LIMITS if rate_limits is None else rate_limits).items()}
+        self.pool_size = pool_size
+        self.pool_sizes = pool_sizes or dict()
+        self.http2 = http2 and httpx is not None
+        self.transport = transport
+        self.sessions = dict()  # key: host and value: session
+        self._sessions_lock = threading.Lock()
+
+    def session(self, host):
+        """
+        Returns the session of a host, creating it on first use
+        :param host: host name (str)
+        :return: requests session, or httpx client when HTTP/2 is used
+        """
+
+        session = self.sessions.get(host)
+        if session is None:
+            with self._sessions_lock:
+                session = self.sessions.get(host)
+                if session is None:
+                    pool_size = self.pool_sizes.get(host, self.pool_size)
+                    if self.http2:
+                        limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+                        session = httpx.Client(http2=True, limits=limits)
+                    else:
+                        session = requests.Session()
+                        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+                        session.mount('https://', adapter)
+                        session.mount('http://', adapter)
+                    self.sessions[host] = session
+        return session
+
+    def _send(self, session, method, url, params, data, headers):
+        if self.transport is not None:
+            return self.transport.send(method, url, params, data, headers)
+        if self.http2:
+            timeout = httpx.Timeout(self.timeout[1], connect=self.timeout[0])
+            return session.request(method, url, params=params, content=data, headers=headers, timeout=timeout)
+        return session.request(method, url, params=params, data=data, headers=headers, timeout=self.timeout)
+
+    def close(self):
+        with self._sessions_lock:
+            for session in self.sessions.values():
+                session.close()
+            self.sessions.clear()
+
+    def _wait(self, attempt, response=None):
+        """
+        Sleeps before a retry, as long as the server asks for or with exponential backoff and full jitter
+        :param attempt: number of the retry, starting at 0 (int)
+        :param response: HTTP response that caused the retry
+        :return: whether to retry, False if the server asks to wait longer than max_retry_after (bool)
+        """
+
+        delay = retry_after(response) if response is not None else None
+        if delay is None:
+            delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        elif delay > self.max_retry_after:
+            return False
+        time.sleep(delay)
+        return True
+
+    def request(self, method, url, params=None, data=None, headers=None):
+        """
+        Sends a request, retrying on connection errors, timeouts and overloaded servers
+        :param method: HTTP method (str)
+        :param url: URL of the endpoint (str)
+        :param params: query parameters (dict)
+        :param data: request body (str or bytes)
+        :param headers: request headers (dict)
+        :return: HTTP response, None if the request failed after all retries
+        """
+
+        return self._request(method, url, params, data, headers, decode=False)
+
+    def request_json(self, method, url, params=None, data=None, headers=None):
+        """
+        Sends a request and decodes its json response, retrying empty or invalid responses
+        :param method: HTTP method (str)
+        :param url: URL of the endpoint (str)
+        :param params: query parameters (dict)
+        :param data: request body (str or bytes)
+        :param headers: request headers (dict)
+        :return: response (json), None if the request failed
+        """
+
+        return self._request(method, url, params, data, headers, decode=True)
+
+    def _request(self, method, url, params, data, headers, decode):
+        """
+        Sends a request with at most max_retries retries, for HTTP errors and invalid json together
+        :param decode: return the decoded json of a 200 response instead of the response (bool)
+        :return: response, its json if decode, None if the request failed
+        """
+
+        host = urlsplit(url).hostname
+        bucket = self.buckets.get(host)
+        session = self.session(host)
+        for attempt in range(self.max_retries + 1):
+            if bucket is not None:
+                bucket.acquire()
+            response = None
+            metrics.inc('http_requests', host=host)
+            try:
+                response = self._send(session, method, url, params, data, headers)
+                metrics.inc('http_bytes', len(response.content), host=host)
+                if response.status_code == 200 and decode:
+                    try:
+                        return response.json()
+                    except ValueError:  # Sometimes nothing is returned, retried like an overloaded server
+                        metrics.inc('http_invalid_json', host=host)
+                        failure = "no valid json"
+                elif response.status_code not in RETRY_STATUS:
+                    if response.status_code != 200:
+                        metrics.inc('http_errors', host=host, status=response.status_code)
+                    return response if not decode else None
+                else:
+                    metrics.inc('http_errors', host=host, status=response.status_code)
+                    failure = "status {}".format(response.status_code)
+            except TRANSPORT_ERRORS as e:
+                metrics.inc('http_errors', host=host, status=e.__class__.__name__)
+                failure = e.__class__.__name__
+            if attempt == self.max_retries or not self._wait(attempt, response):
+                break
+            metrics.inc('http_retries', host=host)
+
+        print("HTTP error: {} from {}".format(failure, url), file=sys.stderr)
+        if decode or response is None or response.status_code == 200:
+            return None
+        return response
+
+
+_client = None
+
+
+def configure(**kwargs):
+    """
+    Replaces the shared client, see HttpClient for the arguments
+    :return: the shared client (HttpClient)
+    """
+
+    global _client
+    if _client is not None:
+        _client.close()
+    _client = HttpClient(**kwargs)
+    return _client
+
+
+def get_client():
+    """
+    Returns the shared client, creating it on first use
+    :return: the shared client (HttpClient)
+    """
+
+    global _client
+    if _client is None:
+        _client = HttpClient()
+    return _client
@@ -0,0 +1,242 @@
+#!/usr/bin/python3
+# This script caches the lookups of the entity linker in its SQLite knowledge base
+# Authors: Jasper Bos (s3794687); Djim C. Casander (s3162753); Esther Ploeger (s3798461)
+# Date:    June 8th, 2021
+
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from urllib.request import pathname2url
+from metrics import metrics
+
+KB_CACHE_SIZE = 50000  # Queries kept in memory, e.g. alias to candidates and ID to label
+MMAP_SIZE = 256 * 1024 * 1024  # Bytes of the knowledge base read through a memory map
+
+
+class QueryCache:
+    """
+    Rows of recent queries of the knowledge base, evicting the least
+    recently used query once the cache is full. The cache can be saved as
+    a hot set and loaded by the next run, so that the entities of earlier
+    questions are known before the first lookup.
+    """
+
+    def __init__(self, max_entries=KB_CACHE_SIZE):
+        """
+        :param max_entries: maximum number of queries (int)
+        """
+
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._rows = OrderedDict()  # key: (SQL, parameters) and value: rows, least recently used first
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._rows)
+
+    def get(self, key):
+        """
+        :param key: SQL and parameters (tuple)
+        :return: rows (list), None if the query is not cached
+        """
+
+        with self._lock:
+            rows = self._rows.get(key)
+            if rows is None:
+                self.misses += 1
+            else:
+                self._rows.move_to_end(key)
+                self.hits += 1
+        metrics.inc('kb_cache', result='miss' if rows is None else 'hit')
+        return rows
+
+    def set(self, key, rows):
+        with self._lock:
+            self._rows[key] = rows
+            self._rows.move_to_end(key)
+            while len(self._rows) > self.max_entries:
+                self._rows.popitem(last=False)
+
+    def load(self, path):
+        """
+        Adds the queries of a hot set file
+        :param path: path to the JSON file written by save (str)
+        :return: number of queries loaded (int)
+        """
+
+        with open(path, 'r', encoding='utf-8') as f:
+            entries = json.load(f)
+        for sql, params, rows in entries[-self.max_entries:]:
+            self.set((sql, tuple(params)), [tuple(row) for row in rows])
+        return len(entries)
+
+    def save(self, path):
+        """
+        Writes the cached queries as a hot set, least recently used first
+        :param path: path to the JSON file (str)
+        """
+
+        with self._lock:
+            entries = [[sql, list(params), rows] for (sql, params), rows in self._rows.items()]
+        tmp = path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(entries, f)
+        os.replace(tmp, path)  # A crash while writing leaves the old hot set
+
+
+class CachingCursor:
+    """
+    Cursor that answers queries from a QueryCache and only asks SQLite about
+    queries it has not seen. Supports the part of the sqlite3 cursor that
+    the entity linker uses: execute, fetchone, fetchall and iteration.
+    """
+
+    def __init__(self, conn, cache):
+        self._conn = conn
+        self._cache = cache
+        self._rows = iter(())
+
+    def execute(self, sql, params=()):
+        key = (sql, tuple(params))
+        rows = self._cache.get(key)
+        if rows is None:
+            rows = self._conn.execute(sql, params).fetchall()
+            self._cache.set(key, rows)
+        self._rows = iter(rows)
+        return self
+
+    def fetchone(self):
+        return next(self._rows, None)
+
+    def fetchall(self):
+        return list(self._rows)
+
+    def __iter__(self):
+        return self._rows
+
+    def close(self):
+        self._rows = iter(())
+
+
+class CachingConnection:
+    """
+    Stands in for the SQLite connection of the entity linker.
+    """
+
+    def __init__(self, conn, cache):
+        """
+        :param conn: connection to the knowledge base (sqlite3.Connection)
+        :param cache: cache of the query results (QueryCache)
+        """
+
+        self.conn = conn
+        self.cache = cache
+
+    def cursor(self):
+        return CachingCursor(self.conn, self.cache)
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def close(self):
+        self.conn.close()
+
+
+def connect_readonly(path, mmap_size=MMAP_SIZE):
+    """
+    Opens a knowledge base read-only, reading it through a memory map
+    :param path: path to the SQLite file (str)
+    :param mmap_size: maximum number of bytes to map, 0 to read without a memory map (int)
+    :return: connection (sqlite3.Connection)
+    """
+
+    uri = 'file:{}?mode=ro'.format(pathname2url(os.path.abspath(path)))
+    conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+    conn.execute('PRAGMA mmap_size = {:d}'.format(mmap_size))
+    return conn
+
+
+_cache = None
+_installed = False  # Whether the entity linker reads through connect_readonly
+_cache_size = KB_CACHE_SIZE
+_hot_set_path = None
+_mmap_size = MMAP_SIZE
+
+
+def configure(size=KB_CACHE_SIZE, hot_set=None, mmap_size=MMAP_SIZE):
+    """
+    Sets up the cache of the entity linker, it is installed when the entity linker is loaded
+    :param size: queries kept in memory, 0 reads every lookup from the knowledge base (int)
+    :param hot_set: path to a hot set file, loaded if it exists and written by save_hot_set (str)
+    :param mmap_size: bytes of the knowledge base read through a memory map (int)
+    """
+
+    global _cache, _installed, _cache_size, _hot_set_path, _mmap_size
+    _cache = None
+    _installed = False
+    _cache_size = size
+    _hot_set_path = hot_set
+    _mmap_size = mmap_size
+
+
+def install():
+    """
+    Opens the knowledge base of the entity linker read-only through a memory map, with the cache
+    in between unless it is disabled, once
+    :return: the shared cache (QueryCache), None if the cache is disabled
+    """
+
+    global _cache, _installed
+    if _installed:
+        return _cache
+    from spacy_entity_linker import DatabaseConnection
+    controller = DatabaseConnection.get_wikidata_instance()  # Downloads the knowledge base if it is missing
+    cache = None
+    conn = connect_readonly(DatabaseConnection.DB_DEFAULT_PATH, _mmap_size)
+    if _cache_size > 0:
+        cache = QueryCache(_cache_size)
+        if _hot_set_path and os.path.exists(_hot_set_path):
+            cache.load(_hot_set_path)
+        conn = CachingConnection(conn, cache)
+    controller.conn.close()  # Its own connection, or the one of an earlier install
+    controller.conn = conn
+    _cache = cache
+    _installed = True
+    return _cache
+
+
+def get_kb_cache():
+    return _cache
+
+
+def save_hot_set(path=None):
+    """
+    Writes the cached queries to a hot set file, for the next run
+    :param path: path to the JSON file, the configured hot set file if None (str)
+    """
+
+    path = path or _hot_set_path
+    if _cache is not None and path:
+        _cache.save(path)
+
+
+def merge_hot_sets(paths, path, size=KB_CACHE_SIZE):
+    """
+    Combines the hot sets of several processes into one hot set file
+    :param paths: paths to the hot set files, the queries of later files are evicted last (list)
+    :param path: path to the combined JSON file (str)
+    :param size: maximum number of queries in the combined hot set (int)
+    :return: number of queries written (int)
+    """
+
+    paths = [hot_set for hot_set in paths if os.path.exists(hot_set)]
+    if not paths or size <= 0:  # No worker had a cache, keep the old hot set
+        return 0
+    cache = QueryCache(size)
+    for hot_set in paths:
+        cache.load(hot_set)
+    cache.save(path)
+    return len(cache)
@@ -0,0 +1,190 @@
+#!/usr/bin/python3
+# This script records the time spent in every stage of the system and counts requests
+# Authors: Jasper Bos (s3794687); Djim C. Casander (s3162753); Esther Ploeger (s3798461)
+# Date:    June 8th, 2021
+
+import bisect
+import functools
+import json
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds of the latency histogram buckets, in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    """
+    Latency histogram with fixed buckets, as used by Prometheus.
+    """
+
+    def __init__(self, buckets=BUCKETS, keep_samples=False):
+        """
+        :param buckets: upper bounds of the buckets, in seconds (tuple)
+        :param keep_samples: also keep every observed value, for exact percentiles (bool)
+        """
+
+        self.buckets = buckets
+        self.samples = [] if keep_samples else None
+        self.counts = [0] * (len(buckets) + 1)  # The last bucket holds everything above the largest bound
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        if self.samples is not None:
+            self.samples.append(value)
+
+    def percentile(self, p):
+        """
+        Estimates a percentile by interpolating within its bucket, exact if the samples are kept
+        :param p: percentile between 0 and 100 (float)
+        :return: estimated value (float), None if nothing was observed
+        """
+
+        if not self.count:
+            return None
+        if self.samples is not None:
+            samples = sorted(self.samples)
+            return samples[min(len(samples) - 1, max(0, math.ceil(p / 100 * len(samples)) - 1))]  # Nearest rank
+        rank = p / 100 * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            if bucket_count and seen + bucket_count >= rank:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.max
+                value = lower + (upper - lower) * (rank - seen) / bucket_count
+                return min(max(value, self.min), self.max)
+            seen += bucket_count
+        return self.max
+
+    def summary(self):
+        return {'count': self.count,
+                'sum': self.sum,
+                'mean': self.sum / self.count if self.count else None,
+                'min': self.min,
+                'max': self.max,
+                'p50': self.percentile(50),
+                'p95': self.percentile(95),
+                'p99': self.percentile(99)}
+
+
+class Metrics:
+    """
+    Registry of stage latency histograms and counters, safe to use from several threads.
+    Counters have a name and optional labels, e.g. http_requests{host="query.wikidata.org"}.
+    """
+
+    def __init__(self, keep_samples=False):
+        """
+        :param keep_samples: keep every observed latency, for exact percentiles (bool)
+        """
+
+        self.keep_samples = keep_samples
+        self.histograms = dict()  # key: stage and value: Histogram
+        self.counters = dict()  # key: (name, labels) and value: count
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = Histogram(keep_samples=self.keep_samples)
+            histogram.observe(seconds)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    @contextmanager
+    def timer(self, stage):
+        """
+        Times the code in a with block
+        :param stage: name of the stage (str)
+        """
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def timed(self, stage):
+        """
+        Decorator that times every call of a function
+        :param stage: name of the stage (str)
+        """
+
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.timer(stage):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+    def to_dict(self):
+        """
+        :return: summary of all stages and counters (dict)
+        """
+
+        with self._lock:
+            stages = {stage: histogram.summary() for stage, histogram in sorted(self.histograms.items())}
+            counters = dict()
+            for (name, labels), value in sorted(self.counters.items()):
+                if labels:
+                    counters.setdefault(name, dict())[",".join("{}={}".format(*label) for label in labels)] = value
+                else:
+                    counters[name] = value
+        return {'stages': stages, 'counters': counters}
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), indent=2)
+
+    def to_prometheus(self, prefix='lt'):
+        """
+        :param prefix: prefix of all metric names (str)
+        :return: all metrics in the Prometheus text format (str)
+        """
+
+        lines = []
+        with self._lock:
+            name = prefix + '_stage_seconds'
+            lines.append('# TYPE {} histogram'.format(name))
+            for stage, histogram in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(histogram.buckets, histogram.counts):
+                    cumulative += bucket_count
+                    lines.append('{}_bucket{{stage="{}",le="{}"}} {}'.format(name, stage, bound, cumulative))
+                lines.append('{}_bucket{{stage="{}",le="+Inf"}} {}'.format(name, stage, histogram.count))
+                lines.append('{}_sum{{stage="{}"}} {}'.format(name, stage, histogram.sum))
+                lines.append('{}_count{{stage="{}"}} {}'.format(name, stage, histogram.count))
+
+            typed = set()
+            for (counter, labels), value in sorted(self.counters.items()):
+                name = '{}_{}_total'.format(prefix, counter)
+                if name not in typed:
+                    lines.append('# TYPE {} counter'.format(name))
+                    typed.add(name)
+                label_text = ",".join('{}="{}"'.format(key, label_value) for key, label_value in labels)
+                lines.append('{}{} {}'.format(name, '{' + label_text + '}' if label_text else '', value))
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()  # Shared registry
+timer = metrics.timer
+timed = metrics.timed
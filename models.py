@@ -0,0 +1,62 @@
+#!/usr/bin/python3
+# This script loads the spaCy language model once and shares it between all stages
+# Authors: Jasper Bos (s3794687); Djim C. Casander (s3162753); Esther Ploeger (s3798461)
+# Date:    June 8th, 2021
+
+import spacy
+import kb_cache
+
+MODEL_NAME = "en_core_web_md"
+ENTITY_LINKER = "entityLinker"
+
+_models = dict()  # key: model name and value: loaded spacy language model
+
+
+def get_nlp(name=MODEL_NAME, entity_linker=False):
+    """
+    Returns the shared language model, loading it on first use
+    :param name: name of the spacy model (str)
+    :param entity_linker: add the entity linker pipe if it is not there yet (bool)
+    :return: spacy language model
+    """
+
+    nlp = _models.get(name)
+    if nlp is None:
+        nlp = spacy.load(name)
+        _models[name] = nlp
+    if entity_linker and ENTITY_LINKER not in nlp.pipe_names:
+        nlp.add_pipe(ENTITY_LINKER, last=True)
+        kb_cache.install()  # Cached, read-only access to its knowledge base
+    return nlp
+
+
+def disabled_components(nlp, entity_linker=False, parser=True):
+    """
+    Lists the pipes a stage does not need
+    :param nlp: spacy language model
+    :param entity_linker: the stage needs the entity linker (bool)
+    :param parser: the stage needs the dependency parser (bool)
+    :return: names of the pipes to disable (list)
+    """
+
+    disable = []
+    if not entity_linker:
+        disable.append(ENTITY_LINKER)
+    if not parser:
+        disable.append("parser")
+        disable.append(ENTITY_LINKER)  # Needs the sentences from the parser
+    return [name for name in nlp.pipe_names if name in disable]
+
+
+def parse(text, entity_linker=False, parser=True, name=MODEL_NAME):
+    """
+    Parses text with the shared model, only running the pipes the stage needs
+    :param text: text to parse (str)
+    :param entity_linker: run the entity linker (bool)
+    :param parser: run the dependency parser (bool)
+    :param name: name of the spacy model (str)
+    :return: nlp parse of text (spacy doc object)
+    """
+
+    nlp = get_nlp(name, entity_linker)
+    return nlp(text, disable=disabled_components(nlp, entity_linker, parser))
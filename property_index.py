@@ -0,0 +1,229 @@
+#!/usr/bin/python3
+# This script looks up Wikidata properties in a local index of their labels and aliases
+# Authors: Jasper Bos (s3794687); Djim C. Casander (s3162753); Esther Ploeger (s3798461)
+# Date:    June 8th, 2021
+
+import argparse
+import gzip
+import os
+import sys
+from collections import Counter
+from cache import fetch_json
+
+PROPERTY_INDEX_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'property_index.tsv')
+FUZZY_THRESHOLD = 0.75  # Minimal Dice coefficient of the character trigrams for a fuzzy match
+ARTICLES = {'the', 'a', 'an'}
+
+ALL_PROPERTIES_QUERY = """SELECT ?property ?label (GROUP_CONCAT(DISTINCT ?alias; SEPARATOR='|') AS ?aliases) WHERE {
+  ?property a wikibase:Property ; rdfs:label ?label .
+  FILTER(LANG(?label) = 'en')
+  OPTIONAL { ?property skos:altLabel ?alias . FILTER(LANG(?alias) = 'en') }
+} GROUP BY ?property ?label"""
+
+
+def normalise_phrase(phrase):
+    """
+    Normalises a property phrase for lookup
+    :param phrase: property phrase (str)
+    :return: lowercased phrase without articles and with single spaces (str)
+    """
+
+    return " ".join(word for word in phrase.lower().split() if word not in ARTICLES)
+
+
+def trigrams(key):
+    """
+    :param key: normalised phrase (str)
+    :return: character trigrams of the phrase, padded with spaces (set)
+    """
+
+    key = " " + key + " "
+    return {key[i:i + 3] for i in range(len(key) - 2)}
+
+
+def open_index_file(path, mode='rt'):
+    if path.endswith('.gz'):
+        return gzip.open(path, mode, encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+class PropertyIndex:
+    """
+    In-memory index of Wikidata property labels and aliases, with exact
+    lookup on the normalised phrase and a character trigram fallback for
+    phrases that are spelled slightly differently.
+    """
+
+    def __init__(self, properties):
+        """
+        :param properties: list of (id, label, aliases) tuples, in order of priority
+        """
+
+        self.labels = dict()  # key: property ID and value: label
+        self.keys = dict()  # key: normalised label or alias and value: property ID
+        for property_id, label, aliases in properties:
+            self.labels[property_id] = label
+            self.keys.setdefault(normalise_phrase(label), property_id)
+        for property_id, label, aliases in properties:  # Labels take precedence over aliases
+            for alias in aliases:
+                self.keys.setdefault(normalise_phrase(alias), property_id)
+
+        self._key_list = list(self.keys)
+        self._key_trigrams = []
+        self._postings = dict()  # key: trigram and value: positions in self._key_list
+        for i, key in enumerate(self._key_list):
+            grams = trigrams(key)
+            self._key_trigrams.append(len(grams))
+            for gram in grams:
+                self._postings.setdefault(gram, []).append(i)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def label(self, property_id):
+        return self.labels.get(property_id)
+
+    def lookup(self, phrase, fuzzy=True):
+        """
+        Finds the property that matches a phrase
+        :param phrase: property phrase (str)
+        :param fuzzy: fall back on trigram matching if there is no exact match (bool)
+        :return: dictionary with key: id and value: label, empty if there is no match
+        """
+
+        key = normalise_phrase(phrase)
+        if not key:
+            return dict()
+        property_id = self.keys.get(key)
+        if property_id is None and fuzzy:
+            property_id = self._fuzzy_lookup(key)
+        if property_id is None:
+            return dict()
+        return {property_id: self.labels[property_id]}
+
+    def _fuzzy_lookup(self, key):
+        """
+        :param key: normalised phrase (str)
+        :return: property ID of the most similar key above FUZZY_THRESHOLD, None if there is none
+        """
+
+        grams = trigrams(key)
+        overlap = Counter()
+        for gram in grams:
+            overlap.update(self._postings.get(gram, ()))
+        best, best_score = None, FUZZY_THRESHOLD
+        for i, shared in overlap.items():
+            score = 2 * shared / (len(grams) + self._key_trigrams[i])
+            if score > best_score or score == best_score and best is not None and i < best:
+                best, best_score = i, score
+        if best is None:
+            return None
+        return self.keys[self._key_list[best]]
+
+
+def load_property_index(path=PROPERTY_INDEX_PATH):
+    """
+    Loads a property index file with lines of id, label and aliases separated by tabs
+    :param path: path to the index, may be gzipped (str)
+    :return: property index (PropertyIndex)
+    """
+
+    properties = []
+    with open_index_file(path) as f:
+        for line in f:
+            if line.startswith('#') or not line.strip():
+                continue
+            columns = line.rstrip('\n').split('\t')
+            aliases = [alias for alias in columns[2].split('|') if alias] if len(columns) > 2 else []
+            properties.append((columns[0], columns[1], aliases))
+    return PropertyIndex(properties)
+
+
+_index = None
+_index_path = PROPERTY_INDEX_PATH
+
+
+def configure(path=PROPERTY_INDEX_PATH):
+    """
+    Sets the index file used by the shared property index, None disables the index
+    :param path: path to the index (str)
+    """
+
+    global _index, _index_path
+    _index = None
+    _index_path = path
+
+
+def get_property_index():
+    """
+    Returns the shared property index, loading it on first use
+    :return: property index (PropertyIndex), None if there is no index file
+    """
+
+    global _index
+    if _index is None and _index_path and os.path.exists(_index_path):
+        _index = load_property_index(_index_path)
+    return _index
+
+
+def lookup_property(phrase):
+    """
+    Finds a property in the shared index
+    :param phrase: property phrase (str)
+    :return: dictionary with key: id and value: label, empty if there is no match or no index
+    """
+
+    index = get_property_index()
+    if index is None:
+        return dict()
+    return index.lookup(phrase)
+
+
+def build_property_index(outfile, lemmatise=False):
+    """
+    Downloads the labels and aliases of all Wikidata properties and writes them to an index file
+    :param outfile: path to write to, gzipped if it ends with .gz (str)
+    :param lemmatise: also add the lemmatised form of every label and alias (bool)
+    """
+
+    data = fetch_json('GET', 'https://query.wikidata.org/sparql',
+                      params={'query': ALL_PROPERTIES_QUERY, 'format': 'json'})
+    if data is None:
+        print("Could not download the Wikidata properties", file=sys.stderr)
+        return
+
+    properties = []
+    for item in data['results']['bindings']:
+        property_id = item['property']['value'].split('/')[-1]
+        label = item['label']['value']
+        aliases = [alias for alias in item.get('aliases', {}).get('value', '').split('|') if alias]
+        properties.append((int(property_id[1:]), property_id, label, aliases))
+    properties.sort()  # Older properties with lower IDs are the more general ones
+
+    if lemmatise:
+        from models import get_nlp, disabled_components
+        nlp = get_nlp()
+        phrases = [phrase for _, _, label, aliases in properties for phrase in [label] + aliases]
+        docs = nlp.pipe(phrases, disable=disabled_components(nlp, parser=False))
+        lemmas = {phrase: " ".join(word.lemma_ for word in doc) for phrase, doc in zip(phrases, docs)}
+        for _, _, label, aliases in properties:
+            aliases.extend(lemmas[phrase] for phrase in [label] + list(aliases) if lemmas[phrase] != phrase)
+
+    with open_index_file(outfile, 'wt') as f:
+        f.write("# id\tlabel\taliases (separated by |)\n")
+        for _, property_id, label, aliases in properties:
+            aliases = [alias.replace('\t', ' ') for alias in dict.fromkeys(aliases) if '|' not in alias]
+            f.write(property_id + '\t' + label.replace('\t', ' ') + '\t' + '|'.join(aliases) + '\n')
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='build the local index of Wikidata property labels')
+    parser.add_argument('outfile', help='path to write the index to, gzipped if it ends with .gz')
+    parser.add_argument('--lemmatise', action='store_true', help='add lemmatised labels and aliases')
+    args = parser.parse_args()
+    build_property_index(args.outfile, args.lemmatise)
+
+
+if __name__ == "__main__":
+    main()
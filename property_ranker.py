@@ -0,0 +1,138 @@
+#!/usr/bin/python3
+# This script ranks Wikidata properties by the similarity of their labels to a property phrase
+# Authors: Jasper Bos (s3794687); Djim C. Casander (s3162753); Esther Ploeger (s3798461)
+# Date:    June 8th, 2021
+
+import numpy as np
+from metrics import metrics
+from models import get_nlp
+from property_index import get_property_index
+
+TOP_K = 0  # Properties returned per phrase, off until its accuracy on the gold answers is known
+MIN_SIMILARITY = 0.6  # Minimal cosine similarity of a ranked property
+
+
+class RankedLabel(str):
+    """
+    Label of a property that was found by similarity instead of by name.
+    Its pairs are only tried after those of the exact properties.
+    """
+
+
+class PropertyRanker:
+    """
+    Matrix of the word vectors of all property labels and aliases of the
+    property index, one normalised row per label or alias. A phrase is
+    scored against every property with one matrix multiplication.
+    """
+
+    def __init__(self, index, nlp):
+        """
+        :param index: property index with the labels and aliases (PropertyIndex)
+        :param nlp: spacy language model with word vectors
+        """
+
+        self.nlp = nlp
+        self.labels = index.labels
+        keys = dict()  # key: property ID and value: its normalised labels and aliases
+        for key, property_id in index.keys.items():
+            keys.setdefault(property_id, []).append(key)
+
+        self.property_ids = []  # Property of every group of rows
+        self.starts = []  # First row of every property
+        rows = []
+        for property_id, phrases in keys.items():
+            vectors = [vector for vector in map(self.vector, phrases) if vector is not None]
+            if vectors:
+                self.property_ids.append(property_id)
+                self.starts.append(len(rows))
+                rows.extend(vectors)
+        self.matrix = np.array(rows, dtype=np.float32).reshape(len(rows), nlp.vocab.vectors_length)
+        self.starts = np.array(self.starts, dtype=np.intp)
+
+    def __len__(self):
+        return len(self.property_ids)
+
+    def vector(self, phrase):
+        """
+        :param phrase: property phrase (str)
+        :return: normalised mean of the word vectors (numpy array), None if no word has a vector
+        """
+
+        vectors = [word.vector for word in self.nlp.make_doc(phrase) if word.has_vector]
+        if not vectors:
+            return None
+        vector = np.mean(vectors, axis=0)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+    def _top(self, scores, k):
+        """
+        :param scores: similarity of a phrase to every property (numpy array)
+        :param k: number of properties (int)
+        :return: dictionary with key: id and value: label (RankedLabel), best first
+        """
+
+        k = min(k, len(scores))
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best])]
+        return {self.property_ids[i]: RankedLabel(self.labels[self.property_ids[i]])
+                for i in best if scores[i] >= MIN_SIMILARITY}
+
+    def rank(self, phrase, k=TOP_K):
+        """
+        Finds the properties with the labels most similar to a phrase
+        :param phrase: property phrase (str)
+        :param k: maximum number of properties (int)
+        :return: dictionary with key: id and value: label (RankedLabel), best first
+        """
+
+        vector = self.vector(phrase)
+        if vector is None or not len(self):
+            return dict()
+        with metrics.timer('property_ranker'):
+            scores = self.matrix @ vector  # Similarity to every label and alias
+            scores = np.maximum.reduceat(scores, self.starts)  # Best label or alias per property
+            return self._top(scores, k)
+
+
+_ranker = None
+_top_k = TOP_K
+
+
+def configure(top_k=TOP_K):
+    """
+    Sets the number of ranked properties added to the candidates, 0 disables the ranker
+    :param top_k: properties per phrase (int)
+    """
+
+    global _ranker, _top_k
+    _ranker = None
+    _top_k = top_k
+
+
+def get_property_ranker():
+    """
+    Returns the shared ranker, building its matrix from the property index on first use
+    :return: property ranker (PropertyRanker), None if it is disabled or there is no index
+    """
+
+    global _ranker
+    if _ranker is None and _top_k > 0:
+        index = get_property_index()
+        if index is not None:
+            _ranker = PropertyRanker(index, get_nlp())
+    return _ranker
+
+
+def rank_properties(phrase):
+    """
+    Finds the properties most similar to a phrase with the shared ranker
+    :param phrase: property phrase (str)
+    :return: dictionary with key: id and value: label, best first, empty if the ranker is disabled
+    """
+
+    ranker = get_property_ranker()
+    if ranker is None:
+        return dict()
+    return ranker.rank(phrase, _top_k)
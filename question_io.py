@@ -0,0 +1,173 @@
+#!/usr/bin/python3
+# This script reads questions and writes answers as streams, with checkpoints to resume a run
+# Authors: Jasper Bos (s3794687); Djim C. Casander (s3162753); Esther Ploeger (s3798461)
+# Date:    June 8th, 2021
+
+import csv
+import io
+import json
+import os
+import sys
+
+STDIO = '-'  # Path that stands for stdin or stdout
+
+
+def guess_format(path):
+    """
+    :param path: path to a question or answer file (str)
+    :return: 'jsonl' for .jsonl files, 'tsv' otherwise (str)
+    """
+
+    return 'jsonl' if path.endswith('.jsonl') else 'tsv'
+
+
+def default_encoding(fmt):
+    """
+    :param fmt: 'tsv' or 'jsonl' (str)
+    :return: encoding of the format, the question files are UTF-16 (str)
+    """
+
+    return 'utf-8' if fmt == 'jsonl' else 'utf-16'
+
+
+def read_questions(path, fmt=None, encoding=None):
+    """
+    Reads questions one at a time
+    :param path: path to a tab separated file of IDs and questions or a JSONL file, '-' for stdin (str)
+    :param fmt: 'tsv' or 'jsonl', guessed from the path if None (str)
+    :param encoding: encoding of the input, the default of the format if None (str)
+    :return: generator of (ID, question) tuples
+    """
+
+    fmt = fmt or guess_format(path)
+    encoding = encoding or default_encoding(fmt)
+    if path == STDIO:
+        f = io.TextIOWrapper(sys.stdin.buffer, encoding=encoding, newline='')
+    else:
+        f = open(path, 'r', encoding=encoding, newline='')
+
+    with f:
+        if fmt == 'jsonl':
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    yield str(record['id']), record['question']
+        else:
+            for row in csv.reader(f, delimiter='\t'):
+                if len(row) > 1:
+                    yield row[0], row[1]
+
+
+class Checkpoint:
+    """
+    Progress of a run: the last answered ID and the size of the output
+    file after it was written. A resumed run skips the answered questions
+    and cuts off anything written after the checkpoint.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: path to the checkpoint file (str)
+        """
+
+        self.path = path
+        self.last_id = None
+        self.offset = 0
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            self.last_id = state['last_id']
+            self.offset = state['offset']
+
+    def save(self, last_id, offset):
+        """
+        Stores the progress, replacing the file so that it is never half written
+        :param last_id: ID of the last answered question (str)
+        :param offset: size of the output file in bytes (int)
+        """
+
+        self.last_id = last_id
+        self.offset = offset
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'last_id': last_id, 'offset': offset}, f)
+        os.replace(tmp_path, self.path)
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def skip_answered(questions, last_id):
+    """
+    Skips the questions up to and including the last answered one
+    :param questions: iterable of (ID, question) tuples
+    :param last_id: ID of the last answered question, None to skip nothing (str)
+    :return: generator of (ID, question) tuples
+    """
+
+    questions = iter(questions)
+    if last_id is not None:
+        for id, q in questions:
+            if id == last_id:
+                break
+    yield from questions
+
+
+class AnswerWriter:
+    """
+    Writes every answer as soon as it is known, as tab separated lines or JSONL.
+    """
+
+    def __init__(self, path, fmt=None, encoding=None, offset=None):
+        """
+        :param path: path to write to, '-' for stdout (str)
+        :param fmt: 'tsv' or 'jsonl', guessed from the path if None (str)
+        :param encoding: encoding of the output, the default of the format if None (str)
+        :param offset: continue an earlier run, cutting the file off at this size in bytes (int)
+        """
+
+        self.fmt = fmt or guess_format(path)
+        encoding = encoding or default_encoding(self.fmt)
+        if path == STDIO:
+            self.f = io.TextIOWrapper(sys.stdout.buffer, encoding=encoding, newline='\n', write_through=True)
+        elif offset is not None and os.path.exists(path):
+            with open(path, 'r+b') as f:
+                f.truncate(offset)
+            self.f = open(path, 'a', encoding=encoding, newline='\n')  # No new byte order mark
+        else:
+            self.f = open(path, 'w', encoding=encoding, newline='\n')
+
+    def write(self, id, answer, record=None):
+        """
+        Writes one answer
+        :param id: ID of the question (str)
+        :param answer: formatted answer (str)
+        :param record: result written to JSONL instead, with the typed answer and this one as answer_text (dict)
+        :return: size of the output in bytes after writing, None for stdout (int)
+        """
+
+        if self.fmt == 'jsonl':
+            if record:
+                line = dict(record)
+                line.update(id=id, answer_text=answer)
+            else:
+                line = {'id': id, 'answer': answer}
+            self.f.write(json.dumps(line, ensure_ascii=False) + '\n')
+        else:
+            self.f.write(str(id) + '\t' + answer + '\n')
+        self.f.flush()
+        if self.f.seekable():
+            return self.f.buffer.tell()
+
+    def close(self):
+        if self.f.buffer is sys.stdout.buffer:
+            self.f.detach()  # Leave stdout open
+        else:
+            self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,148 @@
+#!/usr/bin/python3
+# This script holds the keyword rules for question types and properties, compiled into lookup tables
+# Authors: Jasper Bos (s3794687); Djim C. Casander (s3162753); Esther Ploeger (s3798461)
+# Date:    June 8th, 2021
+
+import re
+
+# Property overrides, in order of priority: (properties, alternatives). A rule matches if
+# one of its alternatives matches, an alternative is a tuple of lemmas and a tuple of
+# phrases that all have to be in the question. Phrases are found in the lowercased question.
+KEYWORD_RULES = [
+    ({'P140': 'religion'}, [((), ('cult-like church',))]),
+    ({'P138': 'named after'}, [(('named', 'after'), ())]),
+    ({'P915': 'filming location'}, [(('film', 'location'), ()), (('where', 'film'), ()), (('film', 'country'), ()),
+                                    (('film', 'city'), ()), (('film', 'place'), ())]),
+    ({'P750': 'distributed by'}, [(('can', 'watch'), ())]),
+    ({'P272': 'production company'}, [(('company', 'direct'), ()), (('company', 'produce'), ())]),
+    ({'P2047': 'duration'}, [((), ('how long',))]),
+    ({'P2142': 'box office'}, [((), ('box office',))]),
+    ({'P577': 'publication date'}, [(('when', 'publicise'), ()), (('when', 'release'), ()),
+                                    (('when',), ('come out',))]),
+    ({'P19': 'place of birth'}, [(('bear', 'country'), ()), (('bear', 'city'), ()), (('bear', 'place'), ())]),
+    ({'P569': 'date of birth'}, [(('bear',), ())]),  # Any other question about birth
+    ({'P136': 'genre'}, [(('genre',), ())]),
+    ({'P921': 'main subject'}, [((), ('main subject',))]),
+    ({'P364': 'original language of film or TV show'}, [((), ('original language',)), (('language', 'spoken'), ())]),
+    ({'P509': 'cause of death', 'P1196': 'manner of death'}, [(('cause', 'death'), ()), (('how', 'die'), ())]),
+    ({'P156': 'followed by'}, [(('follow',), ())]),
+    ({'P6251': 'catchphrase'}, [(('catchphrase',), ())]),
+    ({'P1971': 'number of children', 'P40': 'child'}, [((), ('how many children',))]),
+    ({'P27': 'country of citizenship'}, [((), ('country of citizenship',))]),
+    ({'P495': 'country of origin'}, [((), ('country of origin',))]),
+    ({'P8687': 'social media followers'}, [(('follower',), ())]),
+    ({'P2048': 'height'}, [(('tall',), ())]),
+    ({'P2130': 'cost'}, [(('cost',), ())]),
+    ({'P144': 'based on'}, [((), ('based on',))]),
+    ({'P1922': 'first line'}, [((), ('first line',))]),
+    ({'P2684': 'Kijkwijzer rating'}, [((), ('kijkwijzer',))]),
+    ({'P1477': 'name'}, [((), ('birth name',))]),
+]
+
+# Question types found by keywords, in order of priority: (type, any of these lemmas,
+# none of these lemmas, any of these first words). WHAT_WHICH is resolved from the parse.
+WHAT_WHICH = 'what_which'
+TYPE_RULES = [
+    ('duration', ('long', 'duration', 'minutes', 'time', 'length'), (), ()),  # e.g. 'How long is X?'
+    ('location', ('country', 'location', 'where', 'coordinates'), (), ()),  # e.g. 'Where was X filmed?'
+    ('time', ('century', 'year', 'when', 'month'), (), ()),  # e.g. 'When was X published?'
+    (WHAT_WHICH, (), (), ('What', 'Which')),
+    ('tall', ('tall',), (), ()),  # e.g 'How tall is X?'
+    ('cost', ('cost',), (), ()),  # e.g. 'How much did X cost to make?'
+    ('count', ('many', 'much'), ('follower',), ()),  # e.g. 'How many X films are there?'
+]
+
+
+class RuleSet:
+    """
+    Keyword rules compiled into an index from every trigger word to the
+    rules it can start, so that a question is classified by looking up its
+    own words instead of trying every rule. Adding rules does not make
+    questions that do not contain their words slower.
+    """
+
+    def __init__(self, keyword_rules=KEYWORD_RULES, type_rules=TYPE_RULES):
+        """
+        :param keyword_rules: property overrides in order of priority (list)
+        :param type_rules: question types in order of priority (list)
+        """
+
+        self.keyword_rules = keyword_rules
+        self.type_rules = type_rules
+
+        # Every alternative is indexed under one of its lemmas, or under its first phrase
+        self.lemma_triggers = dict()  # key: lemma and value: list of (priority, lemmas, phrases)
+        self.phrase_triggers = dict()  # key: phrase and value: list of (priority, lemmas, phrases)
+        for priority, (_, alternatives) in enumerate(keyword_rules):
+            for lemmas, phrases in alternatives:
+                alternative = (priority, frozenset(lemmas), phrases)
+                if lemmas:
+                    self.lemma_triggers.setdefault(lemmas[0], []).append(alternative)
+                else:
+                    self.phrase_triggers.setdefault(phrases[0], []).append(alternative)
+
+        # One pass over the question finds the longest phrase at every position, the phrases
+        # that start the same way are added from self.phrase_prefixes
+        all_phrases = sorted({phrase for _, alternatives in keyword_rules for _, phrases in alternatives
+                              for phrase in phrases}, key=len, reverse=True)
+        self.phrase_pattern = re.compile('(?=(' + '|'.join(re.escape(phrase) for phrase in all_phrases) + '))')
+        self.phrase_prefixes = {phrase: [other for other in all_phrases if phrase.startswith(other)]
+                                for phrase in all_phrases}
+
+        self.type_lemmas = dict()  # key: lemma and value: priorities of the type rules
+        self.type_first_words = dict()  # key: first word and value: priorities of the type rules
+        for priority, (_, any_lemmas, _, first_words) in enumerate(type_rules):
+            for lemma in any_lemmas:
+                self.type_lemmas.setdefault(lemma, []).append(priority)
+            for word in first_words:
+                self.type_first_words.setdefault(word, []).append(priority)
+
+    def phrases(self, q):
+        """
+        :param q: input question, plain text (str)
+        :return: phrases of the rules that are in the lowercased question (set)
+        """
+
+        found = set()
+        for match in self.phrase_pattern.finditer(q.lower()):
+            found.update(self.phrase_prefixes[match.group(1)])
+        return found
+
+    def match_keywords(self, lemmas, q):
+        """
+        Finds the property override of the first matching rule
+        :param lemmas: lemmas of the question (set)
+        :param q: input question, plain text (str)
+        :return: dictionary where key: property ID and value: name of property, None if no rule matches
+        """
+
+        phrases = self.phrases(q)
+        best = None
+        candidates = [alternative for lemma in lemmas for alternative in self.lemma_triggers.get(lemma, ())]
+        candidates += [alternative for phrase in phrases for alternative in self.phrase_triggers.get(phrase, ())]
+        for priority, required_lemmas, required_phrases in candidates:
+            if (best is None or priority < best) and required_lemmas <= lemmas and \
+                    all(phrase in phrases for phrase in required_phrases):
+                best = priority
+        if best is None:
+            return None
+        return dict(self.keyword_rules[best][0])
+
+    def match_type(self, lemmas, first_word):
+        """
+        Finds the question type of the first matching keyword rule
+        :param lemmas: lemmas of the question (set)
+        :param first_word: first word of the question (str)
+        :return: question type (str), None if no rule matches
+        """
+
+        candidates = sorted({priority for lemma in lemmas for priority in self.type_lemmas.get(lemma, ())} |
+                            set(self.type_first_words.get(first_word, ())))
+        for priority in candidates:
+            question_type, _, none_lemmas, _ = self.type_rules[priority]
+            if not any(lemma in lemmas for lemma in none_lemmas):
+                return question_type
+        return None
+
+
+RULES = RuleSet()  # Compiled once
@@ -0,0 +1,231 @@
+#!/usr/bin/python3
+# This script answers questions over a local HTTP/JSON API, with the models loaded once
+# Authors: Jasper Bos (s3794687); Djim C. Casander (s3162753); Esther Ploeger (s3798461)
+# Date:    June 8th, 2021
+
+import argparse
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from analysis import analyse_question
+from answer_cache import get_answer_cache, recall_or_analyse
+from answers import QuestionResult
+from models import get_nlp
+from property_index import get_property_index
+from property_ranker import get_property_ranker
+from triple_store import get_triple_store
+from entity_index import get_entity_index
+from kb_cache import save_hot_set
+from system import normalise_question, answer_question, add_config_arguments, configure, \
+    MAX_CONCURRENT_QUERIES
+from system_deps import search_cache_info
+from metrics import metrics
+
+MAX_BODY = 10 * 1024 * 1024  # Largest request body accepted, in bytes
+
+
+class AnswerService:
+    """
+    Answers questions with models that stay loaded between requests.
+    Parsing is done one question or batch at a time on one thread, which
+    also opens the knowledge base of the entity linker, the network stages
+    of different requests run at the same time.
+    """
+
+    def __init__(self, batch_workers=8, batch_size=64, max_queries=MAX_CONCURRENT_QUERIES):
+        """
+        :param batch_workers: questions of a batch answered at the same time (int)
+        :param batch_size: number of questions spacy parses per batch (int)
+        :param max_queries: maximum number of SPARQL queries in flight per question (int)
+        """
+
+        self.batch_workers = batch_workers
+        self.batch_size = batch_size
+        self.max_queries = max_queries
+        self.started = time.time()
+        # spacy pipelines are not shared between threads, and the SQLite connection of the entity linker
+        # only works in the thread that opened it
+        self._parser = ThreadPoolExecutor(max_workers=1)
+
+    def parse(self, function, *args):
+        """
+        Runs a function on the parsing thread
+        :param function: function that uses the language model or entity linker
+        :return: what the function returns
+        """
+
+        return self._parser.submit(function, *args).result()
+
+    def warm_up(self):
+        """
+        Loads the language model, entity linker and local indexes before the first request
+        """
+
+        self.parse(lambda: get_nlp(entity_linker=True))
+        get_property_index()
+        get_property_ranker()
+        get_triple_store()
+        get_entity_index()
+        self.parse(analyse_question, "Who directed The Godfather")  # Opens the knowledge base of the entity linker
+
+    def count(self, name, value=1):
+        metrics.inc('server_' + name, value)
+
+    def _answer(self, id, analysis):
+        if isinstance(analysis, QuestionResult):  # From the answer cache
+            result = analysis
+        else:
+            result = answer_question(analysis, self.max_queries)
+        result.id = id
+        self.count('questions')
+        return result.to_dict()
+
+    def answer(self, question, id=None):
+        """
+        Answers one question
+        :param question: question (str)
+        :param id: ID of the question, returned as is
+        :return: result (dict)
+        """
+
+        q = normalise_question(question)
+        cache = get_answer_cache()
+        analysis = cache.recall(q) if cache is not None else None
+        if analysis is None:
+            analysis = self.parse(analyse_question, q)
+        return self._answer(id, analysis)
+
+    def answer_batch(self, questions):
+        """
+        Answers a batch of questions, in the order they were given
+        :param questions: list of questions (str) or of dicts with 'id' and 'question'
+        :return: results (list of dicts)
+        """
+
+        questions = [item if isinstance(item, dict) else {'id': i, 'question': item}
+                     for i, item in enumerate(questions)]
+        analyses = self.parse(lambda: list(recall_or_analyse(
+            ((normalise_question(item['question']), item.get('id')) for item in questions), self.batch_size)))
+        with ThreadPoolExecutor(max_workers=self.batch_workers) as pool:
+            return list(pool.map(lambda item: self._answer(item[1], item[0]), analyses))
+
+    def metrics(self):
+        """
+        :return: stage latencies and counters of the shared registry, uptime and search cache (dict)
+        """
+
+        summary = metrics.to_dict()
+        summary['uptime'] = time.time() - self.started
+        summary['search_cache'] = search_cache_info()
+        return summary
+
+
+class AnswerHandler(BaseHTTPRequestHandler):
+    """
+    Routes: POST /answer, POST /batch, GET /health and GET /metrics (add ?format=prometheus for text)
+    """
+
+    service = None  # Set by serve()
+
+    def _send_json(self, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length', 0))
+        if length > MAX_BODY:
+            raise ValueError("request body too large")
+        return json.loads(self.rfile.read(length).decode('utf-8'))
+
+    def do_GET(self):
+        self.service.count('requests')
+        if self.path == '/health':
+            self._send_json(200, {'status': 'ok'})
+        elif self.path == '/metrics':
+            self._send_json(200, self.service.metrics())
+        elif self.path == '/metrics?format=prometheus':
+            data = metrics.to_prometheus().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        else:
+            self._send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        self.service.count('requests')
+        if self.path not in ('/answer', '/batch'):
+            self._send_json(404, {'error': 'not found'})
+            return
+        try:
+            body = self._read_json()
+            if self.path == '/answer' and not isinstance(body.get('question'), str):
+                raise ValueError("'question' must be a string")
+            if self.path == '/batch' and not isinstance(body.get('questions'), list):
+                raise ValueError("'questions' must be a list")
+        except (ValueError, AttributeError) as e:  # Invalid json or request
+            self.service.count('errors')
+            self._send_json(400, {'error': str(e)})
+            return
+
+        try:
+            if self.path == '/answer':
+                result = self.service.answer(body['question'], body.get('id'))
+            else:
+                result = self.service.answer_batch(body['questions'])
+        except Exception as e:
+            self.service.count('errors')
+            print("Error while answering: {!r}".format(e), file=sys.stderr)
+            self._send_json(500, {'error': 'internal error'})
+            return
+        self._send_json(200, result)
+
+    def log_message(self, format, *args):
+        pass  # Do not write a line per request to stderr
+
+
+def serve(service, host='127.0.0.1', port=8000):
+    """
+    Runs the HTTP server until it is interrupted, handling every request in its own thread
+    :param service: answer service (AnswerService)
+    :param host: address to listen on (str)
+    :param port: port to listen on (int)
+    """
+
+    AnswerHandler.service = service
+    server = ThreadingHTTPServer((host, port), AnswerHandler)
+    print("Listening on http://{}:{}".format(host, port), file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        save_hot_set()
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='answer questions over a local HTTP/JSON API')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on')
+    parser.add_argument('--port', type=int, default=8000, help='port to listen on')
+    parser.add_argument('--batch-workers', type=int, default=8, help='questions of a batch answered at the same time')
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    configure(args)
+    service = AnswerService(args.batch_workers, args.batch_size, args.max_queries)
+    print("Loading models", file=sys.stderr)
+    service.warm_up()
+    serve(service, args.host, args.port)
+
+
+if __name__ == "__main__":
+    main()
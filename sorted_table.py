@@ -0,0 +1,142 @@
+#!/usr/bin/python3
+# This script reads and writes sorted tab separated tables that are searched on disk
+# Authors: Jasper Bos (s3794687); Djim C. Casander (s3162753); Esther Ploeger (s3798461)
+# Date:    June 8th, 2021
+
+import heapq
+import mmap
+import os
+import tempfile
+
+SORT_CHUNK = 1000000  # Lines sorted in memory at a time when writing a table
+
+
+class SortedTable:
+    """
+    Memory-mapped UTF-8 file of lines sorted by their bytes, searched with
+    binary search on the byte offsets. Only the pages that are read are
+    loaded, so a large table opens instantly and uses little memory.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: path to the sorted file (str)
+        """
+
+        self.path = path
+        self._file = open(path, 'rb')
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(path) else None
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+        self._file.close()
+
+    def _lower_bound(self, key):
+        """
+        :param key: encoded key (bytes)
+        :return: offset of the first line that is not smaller than the key (int)
+        """
+
+        mm = self._mm
+        lo, hi = 0, len(mm)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = mm.rfind(b'\n', 0, mid) + 1
+            end = mm.find(b'\n', start)
+            if end == -1:
+                end = len(mm)
+            if mm[start:end] < key:
+                lo = end + 1
+            else:
+                hi = start
+        return lo
+
+    def iter_prefix(self, prefix):
+        """
+        Reads all lines that start with a prefix
+        :param prefix: prefix, e.g. the first columns followed by a tab (str)
+        :return: generator of lines split into columns (lists of str)
+        """
+
+        if self._mm is None:
+            return
+        mm = self._mm
+        key = prefix.encode('utf-8')
+        position = self._lower_bound(key)
+        while position < len(mm):
+            end = mm.find(b'\n', position)
+            if end == -1:
+                end = len(mm)
+            line = mm[position:end]
+            if not line.startswith(key):
+                break
+            yield line.decode('utf-8').split('\t')
+            position = end + 1
+
+    def contains(self, line):
+        """
+        :param line: whole line without line break (str)
+        :return: whether the table has the line (bool)
+        """
+
+        for columns in self.iter_prefix(line):  # The line itself sorts before longer lines
+            return "\t".join(columns) == line
+        return False
+
+    def get(self, key):
+        """
+        :param key: value of the first column (str)
+        :return: the other columns of the first line with that key (list), None if there is none
+        """
+
+        for columns in self.iter_prefix(key + '\t'):
+            return columns[1:]
+        return None
+
+
+def clean(value):
+    """
+    :param value: value of a column (str)
+    :return: value without tabs and line breaks (str)
+    """
+
+    return value.replace('\t', ' ').replace('\n', ' ').replace('\r', ' ')
+
+
+def write_sorted(lines, path, chunk=SORT_CHUNK):
+    """
+    Sorts lines and writes them to a table, sorting chunks in memory and merging them from disk
+    :param lines: iterable of lines without line breaks (str)
+    :param path: path to write to (str)
+    :param chunk: number of lines sorted in memory at a time (int)
+    """
+
+    runs = []
+    buffer = []
+
+    def flush():
+        buffer.sort()  # Code point order is the byte order of UTF-8
+        run = tempfile.TemporaryFile('w+', encoding='utf-8', newline='\n')
+        run.writelines(line + '\n' for line in buffer)
+        run.seek(0)
+        runs.append(run)
+        buffer.clear()
+
+    for line in lines:
+        buffer.append(line)
+        if len(buffer) >= chunk:
+            flush()
+    if buffer or not runs:
+        flush()
+
+    try:
+        with open(path, 'w', encoding='utf-8', newline='\n') as f:
+            previous = None
+            for line in heapq.merge(*runs, key=lambda line: line.rstrip('\n')):
+                if line != previous:  # Drop duplicates
+                    f.write(line)
+                previous = line
+    finally:
+        for run in runs:
+            run.close()
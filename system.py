@@ -1,208 +1,423 @@
 from system_deps import *
 from system_libs import *
-import csv
+from cache import fetch_json
+from answer_cache import recall_or_analyse
+from rules import RULES
+from property_ranker import RankedLabel
+from answers import QuestionResult, choose_answer_filter, extract_answer
+import answer_cache
+import cache
+import http_client
+import property_index
+import property_ranker
+import triple_store
+import entity_index
+import kb_cache
+import system_deps
+import system_libs
+from metrics import metrics, timed
+from question_io import read_questions, skip_answered, AnswerWriter, Checkpoint, STDIO
 import argparse
-import simplejson  # For Python 3.9-
+import asyncio
+import itertools
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+SPARQL_URL = 'https://query.wikidata.org/sparql'
+MAX_CONCURRENT_QUERIES = 8
+WIKIDATA_ID = re.compile(r'^[PQ]\d+$')  # Skip malformed IDs, they would break the combined query
 
 
 def merge_entities_properties(q, parse, question_type):
     """
     Merges properties and entities from the dependency and library system
     :param q: input question, plain text (str)
-    :param parse: nlp parse of input question (spacy token object)
+    :param parse: analysis of input question (QuestionAnalysis) or its nlp parse (spacy doc object)
     :param question_type: question type abbreviation (str)
     :return: dictionary of entities and properties merged
     """
 
-    deps_ent, deps_prop = get_entity_property_deps(parse, question_type)
-    libs_ents, libs_props = get_entities_properties_libs(q)
+    deps = get_entity_property_deps(parse, question_type)
+    libs = get_entities_properties_libs(q, getattr(parse, 'linked_entities', None))
+
+    return merge_results(deps, libs)
+
 
+def merge_results(deps, libs):
+    """
+    Merges the entities and properties found by both systems, the dependency system takes precedence
+    :param deps: entities and properties of the dependency system (tuple of dicts)
+    :param libs: entities and properties of the library system (tuple of dicts)
+    :return: dictionary of entities and properties merged
+    """
+
+    deps_ent, deps_prop = deps
+    libs_ents, libs_props = libs
     return {**libs_ents, **deps_ent}, {**libs_props, **deps_prop}
 
 
 def check_keywords(parse, q):
     """
     Detects keywords
-    :param parse: nlp parse of input question (spacy token object)
+    :param parse: analysis of input question (QuestionAnalysis) or its nlp parse (spacy doc object)
     :param q: input question, plain text (str)
     :return: dictionary where key: property ID and value: name of property if keyword  exists
     """
 
-    q = q.lower()
-    lemmas = [word.lemma_ for word in parse]
-
-    if 'cult-like church' in q:
-        return {'P140': 'religion'}
-    elif 'named' in lemmas and 'after' in lemmas:
-        return {'P138': 'named after'}
-    elif 'film' in lemmas and 'location' in lemmas or 'where' in lemmas and 'film' in lemmas or \
-            'film' in lemmas and 'country' in lemmas or 'film' in lemmas and 'city' in lemmas or \
-            'film' in lemmas and 'place' in lemmas:
-        return {'P915': 'filming location'}
-    elif 'can' in lemmas and 'watch' in lemmas:
-        return {'P750': 'distributed by'}
-    elif 'company' in lemmas and 'direct' in lemmas or 'company' in lemmas and 'produce' in lemmas:
-        return {'P272': 'production company'}
-    elif 'how long' in q:
-        return {'P2047': 'duration'}
-    elif 'box office' in q:
-        return {'P2142': 'box office'}
-    elif 'when' in lemmas and 'publicise' in lemmas or 'when' in lemmas and 'release' in lemmas or \
-            'when' in lemmas and 'come out' in q:
-        return {'P577': 'publication date'}
-    elif 'bear' in lemmas and 'country' in lemmas or 'bear' in lemmas and 'city' in lemmas or \
-            'bear' in lemmas and 'place' in lemmas:
-        return {'P19': 'place of birth'}
-    elif 'when' in lemmas and 'bear' in lemmas or 'year' in lemmas and 'bear' in lemmas or \
-            'month' and 'bear' in lemmas:
-        return {'P569': 'date of birth'}
-    elif 'genre' in lemmas:
-        return {'P136': 'genre'}
-    elif 'main subject' in q:
-        return {'P921': 'main subject'}
-    elif 'original language' in q or 'language' in lemmas and 'spoken' in lemmas:
-        return {'P364': 'original language of film or TV show'}
-    elif 'cause' in lemmas and 'death' in lemmas or 'how' in lemmas and 'die' in lemmas:
-        return {'P509': 'cause of death', 'P1196': 'manner of death'}
-    elif 'follow' in lemmas:
-        return {'P156': 'followed by'}
-    elif 'catchphrase' in lemmas:
-        return {'P6251': 'catchphrase'}
-    elif 'how many children' in q:
-        return {'P1971': 'number of children', 'P40': 'child'}
-    elif 'country of citizenship' in q:
-        return {'P27': 'country of citizenship'}
-    elif 'country of origin' in q:
-        return {'P495': 'country of origin'}
-    elif "follower" in lemmas:
-        return {'P8687': 'social media followers'}
-    elif 'tall' in lemmas:
-        return {'P2048': 'height'}
-    elif 'cost' in lemmas:
-        return {'P2130': 'cost'}
-    elif 'based on' in q:
-        return {'P144': 'based on'}
-    elif 'first line' in q:
-        return {'P1922': 'first line'}
-    elif 'Kijkwijzer' in q:
-        return {'P2684': 'Kijkwijzer rating'}
-    elif 'birth name' in q:
-        return {'P1477': 'name'}
-
-
-
-def retrieve_answer(q, question_type, ents, props):
-    """
-    Sends query to Wikidata
+    lemmas = getattr(parse, 'lemma_set', None) or {word.lemma_ for word in parse}
+    return RULES.match_keywords(lemmas, q)
+
+
+def build_query(entity_id, property_id, question_type):
+    """
+    Builds the SPARQL query for one entity and property
+    :param entity_id: Wikidata entity ID (str)
+    :param property_id: Wikidata property ID (str)
+    :param question_type: question type abbreviation (str)
+    :return: SPARQL query (str)
+    """
+
+    if question_type != "passive":
+        return "SELECT ?answerLabel WHERE {SERVICE wikibase:label \
+        { bd:serviceParam wikibase:language '[AUTO_LANGUAGE],en'. } wd:" + entity_id + " wdt:" + property_id + " ?answer .}"
+    else:
+        return "SELECT ?answerLabel WHERE {SERVICE wikibase:label \
+        { bd:serviceParam wikibase:language '[AUTO_LANGUAGE],en'. } ?answer wdt:" + property_id + " wd:" + entity_id + " .}"
+
+
+def build_values_query(pairs, question_type):
+    """
+    Builds one SPARQL query for several candidate entities and properties
+    :param pairs: (Wikidata entity ID, Wikidata property ID) tuples (list)
+    :param question_type: question type abbreviation (str)
+    :return: SPARQL query (str)
+    """
+
+    if question_type != "passive":
+        triple = "?entity ?prop ?answer ."
+    else:
+        triple = "?answer ?prop ?entity ."
+    return "SELECT ?entity ?prop ?answerLabel WHERE {" + \
+           "VALUES (?entity ?prop) {" + " ".join("(wd:{} wdt:{})".format(*pair) for pair in pairs) + "} " + \
+           triple + " SERVICE wikibase:label { bd:serviceParam wikibase:language '[AUTO_LANGUAGE],en'. }}"
+
+
+def group_bindings(bindings):
+    """
+    Groups the bindings of a VALUES query by entity and property
+    :param bindings: result bindings with ?entity, ?prop and ?answerLabel (list)
+    :return: dict where key: (entity ID, property ID) and value: bindings with only ?answerLabel (list)
+    """
+
+    groups = dict()
+    for item in bindings:
+        pair = (item['entity']['value'].split('/')[-1], item['prop']['value'].split('/')[-1])
+        groups.setdefault(pair, []).append({'answerLabel': item['answerLabel']})
+    return groups
+
+
+@timed('sparql')
+def run_query(query):
+    """
+    Sends a SPARQL query to the Wikidata endpoint
+    :param query: SPARQL query (str)
+    :return: result bindings (list), None if the endpoint returned an error
+    """
+
+    data = fetch_json('GET', SPARQL_URL, params={'query': query, 'format': 'json'})
+    if data is None:  # e.g. query timeout
+        return None
+    return data['results']['bindings']
+
+
+def retrieve_answer(q, question_type, ents, props, max_workers=MAX_CONCURRENT_QUERIES, result=None):
+    """
+    Looks up all candidates in the local triple store, if there is one, sends one query to Wikidata for
+    the candidates the store has no data for, and answers from the first entity and property with results
     :param q: input question, plain text (str)
     :param question_type: question type abbreviation (str)
     :param ents: possible entities (dict)
     :param props: possible properties (dict)
+    :param max_workers: maximum number of queries in flight when falling back to one query per pair (int)
+    :param result: record to keep the answering entity, property and bindings in (QuestionResult)
     :return: answer to question (list or int)
     """
 
-    for entity_id in ents:
-        for property_id in props:
-            # Build query
-            if question_type != "passive":
-                query = "SELECT ?answerLabel WHERE {SERVICE wikibase:label \
-                { bd:serviceParam wikibase:language '[AUTO_LANGUAGE],en'. } wd:" + entity_id + " wdt:" + property_id + " ?answer .}"
-            else:
-                query = "SELECT ?answerLabel WHERE {SERVICE wikibase:label \
-                { bd:serviceParam wikibase:language '[AUTO_LANGUAGE],en'. } ?answer wdt:" + property_id + " wd:" + entity_id + " .}"
-
-            while True:
-                try:
-                    data = requests.get('https://query.wikidata.org/sparql',
-                                        params={'query': query, 'format': 'json'}).json()
-                    break
-
-                except (json.decoder.JSONDecodeError, simplejson.errors.JSONDecodeError):  # Sometimes nothing is returned
-                    continue  # Try again
-
-            if data['results']['bindings']:
-                results = []
-                for item in data['results']['bindings']:
-                    for var in item:
-                        if item[var]['value']:
-                            if 'coordinate' in q.lower():  # No language specified
-                                if 'xml:lang' not in item[var]:
-                                    results.append(item[var]['value'])
-                                else:
-                                    continue
-                            elif 'year' in q.lower():  # No language specified and only return year
-                                if 'xml:lang' not in item[var] and len(item[var]['value']) == 20:
-                                    results.append(item[var]['value'][:4])
-                            elif 'month' in q.lower():
-                                # No language specified and only return month
-                                if 'xml:lang' not in item[var] and len(item[var]['value']) == 20:
-                                    results.append(item[var]['value'][5:7])
-                            else:
-                                results.append(item[var]['value'])
-
-                if question_type != 'count':
-                    if 'coordinate' in q.lower():  # No language specified
-                        if 'xml:lang' not in item[var]:
-                            return results
-                        else:
-                            continue
-                    elif 'year' in q.lower():  # No language specified and only return year
-                        if 'xml:lang' not in item[var] and len(item[var]['value']) == 20:
-                            return results
-                    return results
-                else:
-                    return len(results)
+    entity_ids = [entity_id for entity_id in ents if WIKIDATA_ID.match(entity_id)]
+    property_ids = [property_id for property_id in props if WIKIDATA_ID.match(property_id)]
+    # Priority order: the exact properties of all entities, then the ranked ones, each entities first
+    exact_ids = [property_id for property_id in property_ids if not isinstance(props[property_id], RankedLabel)]
+    ranked_ids = [property_id for property_id in property_ids if isinstance(props[property_id], RankedLabel)]
+    pairs = [(entity_id, property_id) for property_group in (exact_ids, ranked_ids)
+             for entity_id in entity_ids for property_id in property_group]
+    if not pairs:
+        return None
+    answer_filter = choose_answer_filter(q)  # Once per question, not per binding
+
+    def first_answer(results):
+        for pair, bindings in results:  # In priority order
+            answer = extract_answer(question_type, bindings, answer_filter)
+            if answer is not None:
+                if result is not None:
+                    result.pair, result.bindings = pair, bindings
+                return answer
+        return None
+
+    groups = dict()  # key: pair and value: bindings, of the store and the endpoint
+    missing = pairs  # Pairs the store has no data for
+    store = triple_store.get_triple_store()
+    if store is not None:
+        groups = store.query(entity_ids, property_ids, question_type)
+        missing = [pair for pair in pairs if pair not in groups]
+        # The pairs before the first missing one do not depend on the endpoint
+        local = itertools.takewhile(lambda pair: pair in groups, pairs)
+        answer = first_answer((pair, groups[pair]) for pair in local)
+        if answer is not None or not missing:
+            return answer
+
+    bindings = run_query(build_values_query(missing, question_type))
+    if bindings is not None:
+        groups.update(group_bindings(bindings))
+        return first_answer((pair, groups.get(pair)) for pair in pairs)
+
+    # The combined query failed, send one query per missing pair concurrently instead
+    pool = ThreadPoolExecutor(max_workers=min(max_workers, len(missing)))
+    try:
+        futures = {pair: pool.submit(run_query, build_query(*pair, question_type)) for pair in missing}
+        return first_answer((pair, groups[pair] if pair in groups else futures[pair].result()) for pair in pairs)
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)  # Queries that are no longer needed
+
+
+def normalise_question(q):
+    """
+    Strips the question mark and rewrites Oscar(s) to the label used in Wikidata
+    :param q: input question, plain text (str)
+    :return: normalised question (str)
+    """
+
+    q = q.replace("?", "").rstrip()
+    q = q.replace('Oscars', 'academy awards')
+    q = q.replace('Oscar', 'academy award')
+    q = q.replace('oscars', 'academy awards')
+    q = q.replace('oscar', 'academy award')
+    return q
+
+
+@timed('answer_question')
+def answer_question(analysis, max_queries=MAX_CONCURRENT_QUERIES):
+    """
+    Answers one question
+    :param analysis: analysis of the normalised question (QuestionAnalysis)
+    :param max_queries: maximum number of SPARQL queries in flight (int)
+    :return: result with question type, candidates and answer (QuestionResult)
+    """
+
+    question_type = get_question_type(analysis)
+    ents, props = merge_entities_properties(analysis.text, analysis, question_type)
+    return answer_from_candidates(analysis, question_type, ents, props, max_queries)
+
+
+def answer_from_candidates(analysis, question_type, ents, props, max_queries=MAX_CONCURRENT_QUERIES):
+    """
+    Applies the keyword overrides and queries Wikidata
+    :param analysis: analysis of the normalised question (QuestionAnalysis)
+    :param question_type: question type abbreviation (str)
+    :param ents: possible entities (dict)
+    :param props: possible properties (dict)
+    :param max_queries: maximum number of SPARQL queries in flight (int)
+    :return: result with question type, candidates and answer (QuestionResult)
+    """
+
+    q = analysis.text
+    keyword_props = check_keywords(analysis, q)
+    if keyword_props:  # Overwrite
+        props = keyword_props
+    result = QuestionResult(q, question_type, ents, props)
+    cache = answer_cache.get_answer_cache()
+    cached = None
+    if cache is not None:  # The same candidates give another form of answer to e.g. 'In what year ...'
+        cached = cache.recall_candidates(question_type, choose_answer_filter(q), ents, props)
+    if cached is not None:  # Asked before in other words
+        result.pair, result.answer = cached
+    else:
+        result.answer = retrieve_answer(q, question_type, ents, props, max_queries, result)
+    if cache is not None and result.answer is not None:  # No answer may be a failed request, ask again next time
+        cache.store(result)
+    return result
+
+
+def answer_questions(questions, on_answer, concurrency=1, batch_size=64, n_process=1,
+                     max_queries=MAX_CONCURRENT_QUERIES):
+    """
+    Answers questions, passing the results on in input order; questions in the answer cache are not parsed
+    :param questions: iterable of (normalised question, ID) tuples
+    :param on_answer: called with the result of every question (function)
+    :param concurrency: number of questions answered at the same time, more than 1 uses the asyncio pipeline (int)
+    :param batch_size: number of questions spacy parses per batch (int)
+    :param n_process: number of processes used for parsing (int)
+    :param max_queries: maximum number of SPARQL queries in flight per question (int)
+    """
+
+    if concurrency > 1:
+        from async_pipeline import run_pipeline
+        asyncio.run(run_pipeline(questions, on_answer, concurrency, batch_size, n_process, max_queries))
+    else:
+        for item, id in recall_or_analyse(questions, batch_size, n_process):
+            result = item if isinstance(item, QuestionResult) else answer_question(item, max_queries)
+            result.id = id
+            on_answer(result)
+
+
+def add_config_arguments(parser):
+    """
+    Adds the options that configure the models and endpoints
+    :param parser: argument parser (argparse.ArgumentParser)
+    """
+
+    parser.add_argument('--batch-size', type=int, default=64, help='number of questions parsed per batch')
+    parser.add_argument('--concurrency', type=int, default=1,
+                        help='number of questions answered at the same time, more than 1 uses the asyncio pipeline')
+    parser.add_argument('--n-process', type=int, default=1, help='number of processes used for parsing')
+    parser.add_argument('--max-queries', type=int, default=MAX_CONCURRENT_QUERIES,
+                        help='maximum number of SPARQL queries in flight per question')
+    parser.add_argument('--cache', default=cache.CACHE_PATH, help='path to the response cache')
+    parser.add_argument('--cache-ttl', type=float, default=cache.CACHE_TTL / 86400,
+                        help='days a cached response stays valid')
+    parser.add_argument('--cache-size', type=int, default=cache.CACHE_MAX_ENTRIES,
+                        help='maximum number of cached responses')
+    cache_mode = parser.add_mutually_exclusive_group()  # Offline without a cache would send every request
+    cache_mode.add_argument('--no-cache', action='store_true',
+                            help='send every request and answer every question, do not cache responses or answers')
+    cache_mode.add_argument('--offline', action='store_true',
+                            help='only answer from cached responses, also from expired ones')
+    parser.add_argument('--answer-cache', default=answer_cache.ANSWER_CACHE_PATH,
+                        help='path to the cache of the answers to earlier questions')
+    parser.add_argument('--answer-cache-size', type=int, default=answer_cache.ANSWER_CACHE_MAX_ENTRIES,
+                        help='maximum number of cached answers')
+    parser.add_argument('--no-answer-cache', action='store_true', help='answer every question again')
+    parser.add_argument('--property-index', default=property_index.PROPERTY_INDEX_PATH,
+                        help='path to the local index of Wikidata property labels')
+    parser.add_argument('--no-property-index', action='store_true',
+                        help='always search properties on Wikidata')
+    parser.add_argument('--property-top-k', type=int, default=property_ranker.TOP_K,
+                        help='properties with the most similar labels added per property phrase, '
+                        'e.g. 3 (default 0: none, the ranker is off)')
+    parser.add_argument('--search-limit', type=int, default=system_deps.SEARCH_LIMIT,
+                        help='candidate entities per Wikidata search, all of them go into the combined query')
+    parser.add_argument('--entity-index', help='directory of a local index of Wikidata entity labels, '
+                                               'searched before Wikidata')
+    parser.add_argument('--no-falcon', action='store_true',
+                        help='do not call the Falcon 2.0 API, e.g. when the entity index replaces it')
+    parser.add_argument('--triple-store', help='directory of a local store of Wikidata statements, '
+                                               'the SPARQL endpoint is only asked what it does not contain')
+    parser.add_argument('--kb-cache-size', type=int, default=kb_cache.KB_CACHE_SIZE,
+                        help='entity linker lookups kept in memory, 0 to disable the cache')
+    parser.add_argument('--kb-hot-set', help='file with the entity linker lookups of earlier runs, '
+                                             'loaded at the start and written at the end of a run')
+    parser.add_argument('--kb-mmap-size', type=int, default=kb_cache.MMAP_SIZE,
+                        help='bytes of the entity linker knowledge base read through a memory map')
+    parser.add_argument('--timeout', type=float, default=http_client.TIMEOUT[1],
+                        help='seconds to wait for a response')
+    parser.add_argument('--max-retries', type=int, default=http_client.MAX_RETRIES,
+                        help='maximum number of retries per request')
+    parser.add_argument('--pool-size', type=int, default=http_client.POOL_SIZE,
+                        help='keep-alive connections per host')
+    parser.add_argument('--http2', action='store_true', help='use HTTP/2 if httpx and h2 are installed')
+    parser.add_argument('--metrics', help='write stage timings and counters to this file, '
+                                          'in the Prometheus text format if it ends with .prom')
+
+
+def configure(args):
+    """
+    Configures the shared HTTP client, local indexes, triple store, response cache and answer cache
+    :param args: parsed options of add_config_arguments (argparse.Namespace)
+    """
+
+    http_client.configure(timeout=(http_client.TIMEOUT[0], args.timeout), max_retries=args.max_retries,
+                          pool_size=args.pool_size, http2=args.http2)
+
+    property_index.configure(None if args.no_property_index else args.property_index)
+    property_ranker.configure(args.property_top_k)
+    triple_store.configure(args.triple_store)
+    entity_index.configure(args.entity_index)
+    kb_cache.configure(args.kb_cache_size, args.kb_hot_set, args.kb_mmap_size)
+    system_libs.FALCON = not args.no_falcon
+    system_deps.SEARCH_LIMIT = args.search_limit
+
+    if not args.no_cache:
+        cache.configure(args.cache, args.cache_ttl * 86400, args.cache_size, args.offline)
+    # Answers are only reused with the same indexes and options
+    answer_options = {'property_index': None if args.no_property_index else args.property_index,
+                      'property_top_k': args.property_top_k, 'search_limit': args.search_limit,
+                      'entity_index': args.entity_index, 'falcon': not args.no_falcon,
+                      'triple_store': args.triple_store}
+    answer_cache.configure(None if args.no_cache or args.no_answer_cache else args.answer_cache,
+                           args.answer_cache_size, answer_options)
 
 
 def main():
 
     parser = argparse.ArgumentParser()
-    parser.add_argument('questionfile', help='path to .txt file with all questions')
-    parser.add_argument('outfile', help='path to file to write to')
+    parser.add_argument('questionfile', help='path to file with all questions, tab separated or .jsonl, - for stdin')
+    parser.add_argument('outfile', help='path to file to write to, tab separated or .jsonl, - for stdout')
+    parser.add_argument('--input-format', choices=['tsv', 'jsonl'], help='format of the question file')
+    parser.add_argument('--output-format', choices=['tsv', 'jsonl'], help='format of the output file')
+    parser.add_argument('--encoding', help='encoding of input and output, UTF-16 for tsv and UTF-8 for jsonl')
+    parser.add_argument('--resume', action='store_true',
+                        help='continue after the last answered question of an interrupted run')
+    parser.add_argument('--bindings', action='store_true',
+                        help='also write the result bindings of the answer to JSONL output')
+    add_config_arguments(parser)
     args = parser.parse_args()
 
-    with open(args.questionfile, 'r', encoding="utf-16") as f:
-        total = sum(1 for row in f)
-
-    i = 1
-    with open(args.questionfile, 'r', encoding="utf-16") as inf, open(args.outfile, 'w', encoding="utf-16") as outf:
-        reader = csv.reader(inf, delimiter='\t')
-        for row in reader:
-            id, q = row[0], row[1]
-            q = q.replace("?", "").rstrip()
-            q = q.replace('Oscars', 'academy awards')
-            q = q.replace('Oscar', 'academy award')
-            q = q.replace('oscars', 'academy awards')
-            q = q.replace('oscar', 'academy award')
-            parse = nlp(q)
-            question_type = get_question_type(q)
-            ents, props = merge_entities_properties(q, parse, question_type)
-            if check_keywords(parse, q):  # Overwrite
-                props = check_keywords(parse, q)
-            answer = retrieve_answer(q, question_type, ents, props)
-            if answer:
-                if type(answer) == int:
-                    answer = list(set(str(answer)))
-                else:
-                    answer = list(set(answer))
-                if question_type == "yes/no":
-                    if answer:
-                        outf.write(str(i) + '\t' + 'yes\n')
-                    else:
-                        outf.write(str(i) + '\t' + 'no\n')
-                else:
-                    try:
-                        outf.write(str(i) + '\t' + ','.join(answer) + '\n')
-                    except TypeError:
-                        outf.write(str(i) + '\t' + 'yes\n')
-            else:
-                if question_type == "count":
-                    outf.write(str(i) + '\t' + '12\n')
-                else:
-                    outf.write(str(i) + '\t' + 'yes\n')
-            sys.stderr.write("\r" + "Answered question " + str(i) + " of " + str(total))
+    configure(args)
+
+    questions = read_questions(args.questionfile, args.input_format, args.encoding)
+    checkpoint = None
+    offset = None
+    if args.outfile != STDIO:
+        checkpoint = Checkpoint(args.outfile + '.checkpoint')
+        if args.resume and checkpoint.last_id is not None:
+            questions = skip_answered(questions, checkpoint.last_id)
+            offset = checkpoint.offset
+
+    with AnswerWriter(args.outfile, args.output_format, args.encoding, offset) as writer:
+        answered = 0
+
+        def on_answer(result):
+            nonlocal answered
+            offset = writer.write(result.id, result.text(), result.to_dict(args.bindings))
+            if checkpoint is not None:
+                checkpoint.save(result.id, offset)
+            answered += 1
+            sys.stderr.write("\r" + "Answered question " + str(answered))
             sys.stderr.flush()
-            i += 1
+
+        questions = ((normalise_question(q), id) for id, q in questions)
+        answer_questions(questions, on_answer, args.concurrency, args.batch_size, args.n_process, args.max_queries)
+
+    if checkpoint is not None:
+        checkpoint.remove()  # Finished, nothing to resume
+    kb_cache.save_hot_set()
+
+    info = search_cache_info()
+    sys.stderr.write("\nWikidata search cache: {} hits, {} misses\n".format(info['hits'], info['misses']))
+    if args.metrics:
+        write_metrics(args.metrics)
+
+
+def write_metrics(path):
+    """
+    Writes the stage timings and counters of this run
+    :param path: path to write to, in the Prometheus text format if it ends with .prom (str)
+    """
+
+    with open(path, 'w', encoding='utf-8') as f:
+        if path.endswith('.prom'):
+            f.write(metrics.to_prometheus())
+        else:
+            f.write(metrics.to_json())
 
 
 if __name__ == "__main__":
@@ -3,37 +3,44 @@
 # Authors: Jasper Bos (s3794687); Djim C. Casander (s3162753); Esther Ploeger (s3798461)
 # Date:    June 8th, 2021
 
-import requests
-import spacy
-
-nlp = spacy.load("en_core_web_md")
-
-
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from cache import fetch_json
+from property_index import lookup_property
+from entity_index import lookup_entity
+from property_ranker import rank_properties
+from metrics import metrics, timed
+from analysis import QuestionAnalysis
+from models import parse as nlp_parse
+from rules import RULES, WHAT_WHICH
+
+WIKIDATA_API_URL = 'https://www.wikidata.org/w/api.php'
+SEARCH_CACHE_SIZE = 4096  # Number of search results kept in memory
+SEARCH_LIMIT = 3  # Candidate entities per search string, all of them go into the combined query
+SEARCH_WORKERS = 8  # Searches in flight at the same time
+AWARD_WORDS = {'Academy', 'Awards', 'Award'}  # Title-case words that are not the entity of a count question
+
+
+_search_pool = None
+_search_pool_lock = threading.Lock()
+
+
+@timed('get_question_type')
 def get_question_type(input_q):
     """
     Performs linguistic analysis to determine question type
-    :param input_q: input question, plain text (str)
+    :param input_q: input question, plain text (str) or its analysis (QuestionAnalysis)
     :return: question type, abbreviation (str)
     """
 
-    # Define keywords
-    duration_keywords = ['long', 'duration', 'minutes', 'time', 'length']
-    time_keywords = ['century', 'year', 'when', 'month']
-    location_keywords = ['country', 'location', 'where', 'coordinates']
-
-    # Extract sentence structure
-    parse = nlp(input_q)
-    lemmas = []
-    pos = []
-    dep = []
-    for word in parse:
-        lemmas.append(word.lemma_)
-        pos.append(word.pos_)
-        dep.append(word.dep_)
-
-    sent = parse.text.replace("?", "")  # Strip question mark
-    sent = sent.replace('"', "")  # Strip double apostrophe
-    sent = sent.replace("'", "")  # Strip single apostrophe
+    # Extract sentence structure, only parse if no analysis was given
+    if not isinstance(input_q, QuestionAnalysis):
+        input_q = QuestionAnalysis(nlp_parse(input_q))
+    parse = input_q.doc
+    lemmas = input_q.lemmas
+    pos = input_q.pos
+    dep = input_q.dep
 
     question_type = ""
     if lemmas[0] == "do":
@@ -51,13 +58,8 @@ def get_question_type(input_q):
                     question_type = "XofY"  # e.g. 'Who is the director of X?'
                 if 'dobj' in rel:
                     question_type = "verb_prop"  # e.g. 'Who directed X?'
-        if any(item in duration_keywords for item in lemmas):
-            question_type = "duration"  # e.g. 'How long is X?'
-        elif any(item in location_keywords for item in lemmas):
-            question_type = "location" # e.g. 'Where was X filmed?'
-        elif any(item in time_keywords for item in lemmas):
-            question_type = "time" # e.g. 'When was X published?'
-        elif parse[0].text == "What" or parse[0].text == "Which":
+        keyword_type = RULES.match_type(input_q.lemma_set, parse[0].text)
+        if keyword_type == WHAT_WHICH:
             if parse[1].pos_ == "NOUN":
                 if "AUX" in pos and lemmas[pos.index("AUX")] == "be":
                     question_type = "what_A_is_X_Y" # e.g 'What book is X based on?'
@@ -65,44 +67,37 @@ def get_question_type(input_q):
                     question_type = "what_A_is_X_Y" # e.g. 'Which movies earned X an award?'
                 else:
                     question_type = "what_which_verb" # e.g. 'What awards did X receive?'
-            elif 'about' in lemmas:
+            elif 'about' in input_q.lemma_set:
                 question_type = "about"
             else:
                 question_type = "what_is_Xs_Y" # e.g. 'What is X's hair color?'
-        elif "tall" in lemmas:
-            question_type = "tall" # e.g 'How tall is X?'
-        elif "cost" in lemmas:
-            question_type = "cost" # e.g. 'How much did X cost to make?'
-        elif ("many" in lemmas or "much" in lemmas) and "follower" not in lemmas:
-            question_type = "count" # e.g. 'How many X films are there?'
+        elif keyword_type is not None:
+            question_type = keyword_type  # e.g. duration, location, time, tall, cost or count
 
     return question_type
 
 
+@timed('get_entity_property_deps')
 def get_entity_property_deps(parse, question_type):
     """
     Determine and clean entity and property from question type and parse
-    :param parse: nlp parse of input question (spacy token object)
+    :param parse: nlp parse of input question (spacy doc object) or its analysis (QuestionAnalysis)
     :param question_type: question type abbreviation (str)
     :return: entity and propery (str)
     """
 
-    # Init ent and prop
+    # Init ent and prop, the entity is a list of (text, POS tag, whitespace) tuples
     ent = []
+    ents = None  # Alternative entities in order of priority, searched at the same time
     prop = []
 
     # Extract sentence structure
-    lemmas = []
-    pos = []
-    dep = []
-    for word in parse:
-        lemmas.append(word.lemma_)
-        pos.append(word.pos_)
-        dep.append(word.dep_)
-
-    sent = parse.text.replace("?", "")  # Strip question mark
-    sent = sent.replace('"', "")  # Strip double apostrophe
-    sent = sent.replace("'", "")  # Strip single apostrophe
+    analysis = parse if isinstance(parse, QuestionAnalysis) else QuestionAnalysis(parse)
+    lemmas = analysis.lemmas
+    pos = analysis.pos
+    dep = analysis.dep
+    sent = analysis.sent
+    parse = analysis.doc
 
     if question_type == "XofY":
         # Property: from AUX to ADP
@@ -135,13 +130,13 @@ def get_entity_property_deps(parse, question_type):
                 except:
                     pass
 
-        ent = sent.split(" ")[pos.index('ADP') + 1:]  # assuming it always ends with '?'
+        ent = words(analysis, pos.index('ADP') + 1, len(parse), strip=True)
 
     elif question_type == "verb_prop":
         # Find entity: direct object (phrase!)
         for word in parse:
             if word.dep_ == 'dobj':
-                ent = phrase(word)
+                ent = subtree_words(analysis, word)
 
         main_verb = parse[dep.index("ROOT")]
         prop = [main_verb.lemma_]
@@ -149,43 +144,19 @@ def get_entity_property_deps(parse, question_type):
     elif question_type == "duration":
         prop = {'P2047': 'duration'}
         # Find entity: probably follows main verb (ROOT)
-        entity_quotes = []
-        entity_istitle = []
-        for word in parse:
-            if word.text == '"':
-                entity_quotes.append((word.i, word.text))
-            if word.text.istitle() and word.i != 0:
-                entity_istitle.append((word.i, word.text))
-        if len(entity_quotes) > 1:
-            ent = parse[entity_quotes[0][0] + 1:entity_quotes[-1][0]].text.split(" ")
-        elif entity_istitle:
-            ent = parse[entity_istitle[0][0]:entity_istitle[-1][0] + 1].text.split(" ")
-        else:
-            ent = sent.split(" ")[dep.index("ROOT") + 1:]
+        ents = entity_spans(analysis)
 
     elif question_type == "passive":
         for word in parse:
             if word.dep_ == 'pobj':
-                ent = phrase(word)
+                ent = subtree_words(analysis, word)
 
         # Find prop: probably follows main verb (ROOT)
         for word in parse:
             if word.pos_ == "VERB" and word.dep_ == "ROOT":
                 prop = [word.text]
     elif question_type == "location":
-        entity_quotes = []
-        entity_istitle = []
-        for word in parse:
-            if word.text == '"':
-                entity_quotes.append((word.i, word.text))
-            if word.text.istitle() and word.i != 0:
-                entity_istitle.append((word.i, word.text))
-        if len(entity_quotes) > 1:
-            ent = parse[entity_quotes[0][0] + 1:entity_quotes[-1][0]].text.split(" ")
-        elif entity_istitle:
-            ent = parse[entity_istitle[0][0]:entity_istitle[-1][0] + 1].text.split(" ")
-        else:
-            ent = sent.split(" ")[dep.index("ROOT") + 1:]
+        ents = entity_spans(analysis)
         if 'from' in lemmas:
             prop = {'P19': 'place of birth', 'P495': 'country of origin'}
         elif 'filmed' in sent:
@@ -194,19 +165,7 @@ def get_entity_property_deps(parse, question_type):
             prop = {'P19': 'place of birth'}
 
     elif question_type == "time":
-        entity_quotes = []
-        entity_istitle = []
-        for word in parse:
-            if word.text == '"':
-                entity_quotes.append((word.i, word.text))
-            if word.text.istitle() and word.i != 0:
-                entity_istitle.append((word.i, word.text))
-        if len(entity_quotes) > 1:
-            ent = parse[entity_quotes[0][0] + 1:entity_quotes[-1][0]].text.split(" ")
-        elif entity_istitle:
-            ent = parse[entity_istitle[0][0]:entity_istitle[-1][0] + 1].text.split(" ")
-        else:
-            ent = sent.split(" ")[dep.index("ROOT") + 1:]
+        ents = entity_spans(analysis)
         if 'born' in sent or 'birthday' in sent:
             prop = {'P569': 'date of birth'}
         elif 'release' in lemmas or 'come out' in sent or 'premiere' in sent \
@@ -217,19 +176,7 @@ def get_entity_property_deps(parse, question_type):
         # Filter property answers based on data type of answer using VALUES
         pass
     elif question_type == "what_A_is_X_Y":
-        entity_quotes = []
-        entity_istitle = []
-        for word in parse:
-            if word.text == '"':
-                entity_quotes.append((word.i, word.text))
-            if word.text.istitle() and word.i != 0:
-                entity_istitle.append((word.i, word.text))
-        if len(entity_quotes) > 1:
-            ent = parse[entity_quotes[0][0] + 1:entity_quotes[-1][0]].text.split(" ")
-        elif entity_istitle:
-            ent = parse[entity_istitle[0][0]:entity_istitle[-1][0] + 1].text.split(" ")
-        else:
-            ent = sent.split(" ")[dep.index("ROOT") + 1:]
+        ents = entity_spans(analysis)
         if parse[-2:].text.split(" ") == ['influenced', 'by'] or 'earned' in sent:
             prop = parse[-2:].text.split(" ")
         elif "AUX" in pos:
@@ -243,18 +190,7 @@ def get_entity_property_deps(parse, question_type):
         # Find property: probably words between first word and POS:AUX
         prop = parse[1:pos.index("AUX")].text.split(" ")
     elif question_type == "about":
-        entity_quotes = []
-        entity_istitle = []
-        for word in parse:
-            if word.text == '"':
-                entity_quotes.append((word.i, word.text))
-            if word.text.istitle() and word.i != 0:
-                entity_istitle.append((word.i, word.text))
-        if len(entity_quotes) > 1:
-            ent = parse[entity_quotes[0][0] + 1:entity_quotes[-1][0]].text.split(" ")
-        elif entity_istitle:
-            ent = parse[entity_istitle[0][0]:entity_istitle[-1][0] + 1].text.split(" ")
-        # Find entity
+        ents = entity_spans(analysis, fallback=False)
         prop = ["main", "subject"]
     elif question_type == "what_is_Xs_Y":
         # Find entity: Either between POS:AUX (lemmas[2]) and 's, or:
@@ -270,41 +206,29 @@ def get_entity_property_deps(parse, question_type):
         prop = parse[-2:].text.split(" ")
 
     elif question_type == "count":
-        entity_quotes = []
-        entity_istitle = []
-        for word in parse:
-            if word.text == '"':
-                entity_quotes.append((word.i, word.text))
-            if word.text.istitle() and word.i != 0 and word.text != "Academy" and word.text != "Awards" and word.text != "Award":
-                entity_istitle.append((word.i, word.text))
-        if len(entity_quotes) > 1:
-            ent = parse[entity_quotes[0][0]+1:entity_quotes[-1][0]].text.split(" ")
-        elif entity_istitle:
-            ent = parse[entity_istitle[0][0]:entity_istitle[-1][0]+1].text.split(" ")
-        else:
-            ent = sent.split(" ")[dep.index("ROOT") + 1:]
+        ents = entity_spans(analysis, exclude=AWARD_WORDS)
         if "AUX" in pos:
             prop = parse[2:pos.index("AUX")].text.split(" ")
-            prop = list(set(prop) - set(ent))
+            prop = list(set(prop) - set(span_text(ents[0] if ents else []).split(" ")))
     elif question_type == "yes/no":
         main_verb_id = dep.index("ROOT")
-        ent = lemmas[1:main_verb_id]
-        prop_broad = lemmas[main_verb_id + 1:]
-        prop = [w for w in prop_broad if pos[lemmas.index(w)] != "DET"]
+        ent = words(analysis, 1, main_verb_id, lemma=True)
+        prop = [w for w, w_pos in zip(lemmas[main_verb_id + 1:], pos[main_verb_id + 1:]) if w_pos != "DET"]
 
     else:
         pass
 
-    # Filter entity: starts with first capital letter and start is not an adjective (e.g. the Dutch movie ...)
-    try:
-        start = min([ent.index(word) for word in ent if word.istitle() and
-                     pos[sent.split(" ").index(word)] != "ADJ"])
-        ent = ent[start:]
-    except ValueError:
-        pass
+    # Filter entities: start with first capital letter and start is not an adjective (e.g. the Dutch movie ...)
+    if ents is None:
+        ents = [ent]
+    for i, span in enumerate(ents):
+        for start, (text, word_pos, _) in enumerate(span):
+            if text.istitle() and word_pos != "ADJ":
+                ents[i] = span[start:]
+                break
 
-    # Convert entity and property from list to string
-    ent = " ".join(ent)
+    # Convert entities and property from list to string
+    ent = [span_text(span) for span in ents]
     if type(prop) == list:
         prop = " ".join(prop)
         ent, prop = retrieve_id_label(ent, prop)
@@ -314,57 +238,207 @@ def get_entity_property_deps(parse, question_type):
     return ent, prop
 
 
-def phrase(word):
+def words(analysis, start, end, strip=False, lemma=False):
+    """
+    Returns the words of a span of the question
+    :param analysis: analysis of input question (QuestionAnalysis)
+    :param start: position of the first token (int)
+    :param end: position after the last token (int)
+    :param strip: strip question marks and apostrophes like QuestionAnalysis.sent (bool)
+    :param lemma: use the lemmas instead of the words (bool)
+    :return: list of (text, POS tag, whitespace) tuples
+    """
+
+    span = []
+    for word in analysis.doc[start:end]:
+        text = analysis.lemmas[word.i] if lemma else word.text
+        if strip:  # May leave an empty word, its whitespace is kept
+            text = text.replace("?", "").replace('"', "").replace("'", "")
+        span.append((text, analysis.pos[word.i], word.whitespace_))
+    return span
+
+
+def span_text(span):
+    """
+    :param span: list of (text, POS tag, whitespace) tuples
+    :return: text of the span, with the whitespace of the question (str)
     """
-    Returns a list of the full phrase, derived from a word
+
+    return "".join(text + whitespace for text, _, whitespace in span).strip()
+
+
+def subtree_words(analysis, word):
+    """
+    Returns the words of the full phrase, derived from a word
+    :param analysis: analysis of input question (QuestionAnalysis)
     :param word: word object from nlp parse (spacy token object)
-    :return: phrase (list)
+    :return: list of (text, POS tag, whitespace) tuples
+    """
+
+    return words(analysis, word.left_edge.i, word.right_edge.i + 1)
+
+
+def entity_spans(analysis, exclude=(), fallback=True):
+    """
+    Finds the possible entities, in order of priority: between the outer double quotes, from the first
+    to the last title-case word and the words after the main verb
+    :param analysis: analysis of input question (QuestionAnalysis)
+    :param exclude: title-case words that are not part of entities (set)
+    :param fallback: also use the words after the main verb (bool)
+    :return: list of spans, lists of (text, POS tag, whitespace) tuples
+    """
+
+    spans = []
+    quotes = analysis.quotes
+    if len(quotes) > 1:
+        spans.append(words(analysis, quotes[0] + 1, quotes[-1]))
+    titles = [i for i in analysis.titles if analysis.doc[i].text not in exclude] if exclude else analysis.titles
+    if titles:
+        spans.append(words(analysis, titles[0], titles[-1] + 1))
+    if fallback and "ROOT" in analysis.dep:
+        spans.append(words(analysis, analysis.dep.index("ROOT") + 1, len(analysis.doc), strip=True))
+    return [span for span in spans if span]
+
+
+def normalise_search(search):
+    """
+    Normalises a search string, so that the same phrase is only searched once
+    :param search: search string (str)
+    :return: lowercased search string with single spaces (str)
+    """
+
+    return " ".join(search.split()).lower()  # wbsearchentities is case-insensitive
+
+
+class SearchFailed(Exception):
+    """
+    The Wikidata search sent no response, e.g. a timeout. Raised inside the
+    cached search, so that the failure is not remembered as 'no result'.
+    """
+
+
+@lru_cache(maxsize=SEARCH_CACHE_SIZE)
+def _search_wikidata(search, search_type, limit=1):
+    """
+    Searches Wikidata, only called on a miss of the in-memory cache
+    :param search: normalised search string (str)
+    :param search_type: 'item' or 'property' (str)
+    :param limit: number of results (int)
+    :return: tuple of (id, label) of the best results, empty if there is none
+    :raises SearchFailed: if the request failed, lru_cache does not keep exceptions
+    """
+
+    params = {'action': 'wbsearchentities',
+              'language': 'en',
+              'format': 'json',
+              'type': search_type,
+              'limit': limit,
+              'search': search}
+
+    metrics.inc('search_misses')
+    json_r = fetch_json('GET', WIKIDATA_API_URL, params)
+    if json_r is None:
+        raise SearchFailed(search)
+    return tuple((result['id'], result['label']) for result in json_r['search'][:limit])
+
+
+def search_wikidata(search, search_type, limit=1):
+    """
+    Searches Wikidata for an item or property
+    :param search: search string (str)
+    :param search_type: 'item' or 'property' (str)
+    :param limit: number of results (int)
+    :return: dictionary with key: id and value: label, best result first, empty if there is no result
+    """
+
+    search = normalise_search(search)
+    if not search:
+        return dict()
+    metrics.inc('search_lookups')
+    try:
+        return dict(_search_wikidata(search, search_type, limit))
+    except SearchFailed:  # Searched again next time
+        return dict()
+
+
+def search_wikidata_many(searches, search_type, limit=1):
+    """
+    Searches Wikidata for several alternative strings at the same time
+    :param searches: search strings, in order of priority (list)
+    :param search_type: 'item' or 'property' (str)
+    :param limit: number of results per search string (int)
+    :return: dictionary with key: id and value: label, the results of the first string that has any
+    """
+
+    if len(searches) == 1:
+        return search_wikidata(searches[0], search_type, limit)
+    for found in get_search_pool().map(lambda search: search_wikidata(search, search_type, limit), searches):
+        if found:
+            return found
+    return dict()
+
+
+def get_search_pool():
+    """
+    Returns the thread pool for concurrent searches, creating it on first use
+    :return: thread pool (ThreadPoolExecutor)
     """
 
-    return [child.text for child in word.subtree]
+    global _search_pool
+    if _search_pool is None:
+        with _search_pool_lock:
+            if _search_pool is None:
+                _search_pool = ThreadPoolExecutor(max_workers=SEARCH_WORKERS)
+    return _search_pool
 
 
+def search_cache_info():
+    """
+    Reports how often a search was answered from the in-memory cache
+    :return: dictionary with hits, misses and size of the cache
+    """
+
+    info = _search_wikidata.cache_info()
+    return {'hits': info.hits, 'misses': info.misses, 'size': info.currsize, 'maxsize': info.maxsize}
+
+
+@timed('retrieve_id_label')
 def retrieve_id_label(ent, prop):
     """
     Get entity and property dictionaries with ids and labels
-    :param ent: entity (str)
+    :param ent: entity, or alternative entities in order of priority (str or list)
     :param prop: property (str)
-    :return: entity and property dictionaries with key: id and value: label
+    :return: entity and property dictionaries with key: id and value: label, best candidates first
     """
 
-    url = 'https://www.wikidata.org/w/api.php'
-
-    params_prop = {'action': 'wbsearchentities',
-                   'language': 'en',
-                   'format': 'json',
-                   'type': 'property'}
-
-    params_ent = {'action': 'wbsearchentities',
-                  'language': 'en',
-                  'format': 'json',
-                  'type': 'item'}
+    searches = list(dict.fromkeys(item for item in ([ent] if isinstance(ent, str) else ent) if item))
 
+    prop_search = None
     if prop:
-        # Find property in Wikidata
-        params_prop['search'] = prop
-        try:
-            json_p = requests.get(url, params_prop).json()
-            prop = {json_p['search'][0]['id']: json_p['search'][0]['label']}
-        except IndexError:  # No result
-            prop = dict()  # Empty dict
+        # Find property in the local index and the properties with the most similar labels,
+        # otherwise in Wikidata
+        local_prop = lookup_property(prop)
+        metrics.inc('property_index', result='hit' if local_prop else 'miss')
+        ranked_prop = rank_properties(prop)
+        metrics.inc('property_ranker', result='hit' if ranked_prop else 'miss')
+        if not local_prop and not ranked_prop:  # Search at the same time as the entities
+            prop_search = get_search_pool().submit(search_wikidata, prop, 'property')
+        prop = dict(local_prop)
+        for id, label in ranked_prop.items():  # A property found by name stays exact
+            prop.setdefault(id, label)
     else:
         prop = dict()  # Empty dict
 
-    if ent:
-        # Find entity in Wikidata
-        params_ent['search'] = ent
-        try:
-            json_e = requests.get(url, params_ent).json()
-            ent = {json_e['search'][0]['id']: json_e['search'][0]['label']}
-
-        except IndexError:  # No result
-            ent = dict()  # Empty dict
-    else:
-        ent = dict()  # Empty dict
-
+    # Find the first alternative in the local index, otherwise the top candidates in Wikidata
+    ent = dict()
+    for search in searches:
+        ent = lookup_entity(search, SEARCH_LIMIT)
+        if ent:
+            break
+    metrics.inc('entity_index', result='hit' if ent else 'miss')
+    if not ent and searches:
+        ent = search_wikidata_many(searches, 'item', SEARCH_LIMIT)
+
+    if prop_search is not None:
+        prop = prop_search.result()
     return ent, prop
@@ -3,15 +3,15 @@
 # Authors: Jasper Bos (s3794687); Jim Casander (s3162753); Esther Ploeger (s3798461)
 # Date:    June 8th, 2021
 
-import requests
-import spacy
 import sys
-import json
+from models import get_nlp, parse as nlp_parse, ENTITY_LINKER
+from cache import fetch_json
+from metrics import timed
 
-nlp = spacy.load("en_core_web_md")
-nlp.add_pipe("entityLinker", last=True)
+FALCON = True  # Set to False to skip the Falcon 2.0 API, e.g. when the local entity index replaces it
 
 
+@timed('call_falcon')
 def call_falcon(q):
     """
     Calls the Falcon 2.0 API to identify the relations and entities of Wikidata in q
@@ -25,34 +25,43 @@ def call_falcon(q):
     q = q.replace('movie', '')  # Improve performance
     q = q.replace('film', '')  # Improve performance
     payload = '{"text":"' + q + '"}'
-    r = requests.post(url, data=payload.encode('utf-8'), headers=headers)
-    if r.status_code == 200:  # OK
-        response = r.json()
+    response = fetch_json('POST', url, data=payload.encode('utf-8'), headers=headers)
+    if response is not None:  # OK
         entities = {result[0].split('/')[-1][:-1]: result[1] for result in response['entities_wikidata']}
         relations = {result[0].split('/')[-1][:-1]: result[1] for result in response['relations_wikidata']}
         return entities, relations
     else:
         print(q, file=sys.stderr)
-        print("Falcon 2.0 API error: status {}".format(r.status_code), file=sys.stderr)
+        print("Falcon 2.0 API error: no response", file=sys.stderr)
         return dict(), dict()
 
 
+@timed('call_entitylinker')
 def call_entitylinker(q):
     """
     Uses Spacy Entity Linker to identify the entities of Wikidata in q.
-    :param q: question (str)
+    :param q: question (str) or its nlp parse without the entity linker (spacy doc object)
     :return: dict of entities and relations where key: id and value: label
     """
 
-    doc = nlp(q)
+    if isinstance(q, str):
+        doc = nlp_parse(q, entity_linker=True)
+    else:
+        doc = get_nlp(entity_linker=True).get_pipe(ENTITY_LINKER)(q)
     return {'Q' + str(ent.get_id()): ent.get_label() for ent in doc._.linkedEntities}
 
 
-def get_entities_properties_libs(q):
+def get_entities_properties_libs(q, linked_entities=None):
     """
     Uses Spacy Entity Linker and Falcon2.0 to identify the entities of Wikidata in q.
     :param q: question (str)
+    :param linked_entities: entities already found by the entity linker, avoids parsing q again (dict)
     :return: dicts of entities and relations where key: id and value: label
     """
-    entities1, relations = call_falcon(q)
-    return {**entities1, **call_entitylinker(q)}, relations
+    if FALCON:
+        entities1, relations = call_falcon(q)
+    else:
+        entities1, relations = dict(), dict()
+    if linked_entities is None:
+        linked_entities = call_entitylinker(q)
+    return {**entities1, **linked_entities}, relations
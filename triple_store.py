@@ -0,0 +1,304 @@
+#!/usr/bin/python3
+# This script answers one-hop Wikidata lookups from a local store built from a filtered dump
+# Authors: Jasper Bos (s3794687); Djim C. Casander (s3162753); Esther Ploeger (s3798461)
+# Date:    June 8th, 2021
+
+import argparse
+import bz2
+import gzip
+import json
+import os
+import sys
+import tempfile
+from metrics import metrics
+from sorted_table import SortedTable, write_sorted, clean
+
+# Files of a store directory
+SP_FILE = 'sp.tsv'  # subject, property, kind, value and language, sorted by subject and property
+PO_FILE = 'po.tsv'  # property, object and subject of item values, sorted by property and object
+LABELS_FILE = 'labels.tsv'  # entity ID and English label, of the entities of the dump and their item values
+SUBJECTS_FILE = 'subjects.tsv'  # entity IDs of the dump, whose statements are all in the store
+PROPERTIES_FILE = 'properties.tsv'  # property IDs that were kept, only written if not all of them were
+
+ITEM = 'i'  # Kind of a value that is a Wikidata item, the other values are literals
+LITERAL = 'l'
+
+
+class TripleStore:
+    """
+    Truthy statements (wdt:) and English labels of a Wikidata subset, indexed
+    from subject to object and from object to subject. Lookups return result
+    bindings in the shape of the SPARQL endpoint, with ?answerLabel. The
+    store knows which subjects and properties it covers, so that a covered
+    lookup without statements is an answer as well.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: path to the store directory (str)
+        """
+
+        self.sp = SortedTable(os.path.join(path, SP_FILE))
+        self.po = SortedTable(os.path.join(path, PO_FILE))
+        self.labels = SortedTable(os.path.join(path, LABELS_FILE))
+        subjects = os.path.join(path, SUBJECTS_FILE)
+        self.subjects_table = SortedTable(subjects) if os.path.exists(subjects) else None  # None: unknown
+        self.properties = None  # None: all properties were kept
+        if os.path.exists(os.path.join(path, PROPERTIES_FILE)):
+            with open(os.path.join(path, PROPERTIES_FILE), 'r', encoding='utf-8') as f:
+                self.properties = {line.strip() for line in f if line.strip()}
+
+    def close(self):
+        for table in (self.sp, self.po, self.labels, self.subjects_table):
+            if table is not None:
+                table.close()
+
+    def covers(self, entity_id, property_id):
+        """
+        :param entity_id: Wikidata entity ID (str)
+        :param property_id: Wikidata property ID (str)
+        :return: whether all statements of the entity with the property are in the store (bool)
+        """
+
+        if self.subjects_table is None or (self.properties is not None and property_id not in self.properties):
+            return False
+        return self.subjects_table.contains(entity_id)
+
+    def label(self, entity_id):
+        """
+        :param entity_id: Wikidata ID (str)
+        :return: English label (str), None if there is none
+        """
+
+        columns = self.labels.get(entity_id)
+        return columns[0] if columns else None
+
+    def _item_binding(self, entity_id):
+        label = self.label(entity_id)
+        if label is None:  # Not in the store, the label service of the endpoint may know it
+            return None
+        return {'answerLabel': {'type': 'literal', 'value': label, 'xml:lang': 'en'}}
+
+    def objects(self, entity_id, property_id):
+        """
+        Looks up wd:entity wdt:property ?answer
+        :param entity_id: Wikidata entity ID (str)
+        :param property_id: Wikidata property ID (str)
+        :return: result bindings (list), None if an item value has no stored label
+        """
+
+        bindings = []
+        for _, _, kind, value, lang in self.sp.iter_prefix(entity_id + '\t' + property_id + '\t'):
+            if kind == ITEM:
+                binding = self._item_binding(value)
+                if binding is None:
+                    return None
+                bindings.append(binding)
+            else:
+                binding = {'type': 'literal', 'value': value}
+                if lang:
+                    binding['xml:lang'] = lang
+                bindings.append({'answerLabel': binding})
+        return bindings
+
+    def subjects(self, property_id, entity_id):
+        """
+        Looks up ?answer wdt:property wd:entity
+        :param property_id: Wikidata property ID (str)
+        :param entity_id: Wikidata entity ID (str)
+        :return: result bindings (list), None if a subject has no stored label
+        """
+
+        bindings = [self._item_binding(subject) for _, _, subject in
+                    self.po.iter_prefix(property_id + '\t' + entity_id + '\t')]
+        return None if None in bindings else bindings
+
+    def query(self, entity_ids, property_ids, question_type):
+        """
+        Looks up all candidate entities and properties, like the combined SPARQL query
+        :param entity_ids: Wikidata entity IDs (list)
+        :param property_ids: Wikidata property IDs (list)
+        :param question_type: question type abbreviation (str)
+        :return: dict where key: (entity ID, property ID) and value: result bindings (list), without the
+                 pairs the store cannot answer, an empty list if the store covers a pair without statements
+        """
+
+        groups = dict()
+        with metrics.timer('triple_store'):
+            for entity_id in entity_ids:
+                for property_id in property_ids:
+                    if question_type != "passive":
+                        bindings = self.objects(entity_id, property_id)
+                        covered = bindings == [] and self.covers(entity_id, property_id)
+                    else:  # The subjects with the entity as value may be outside the subset
+                        bindings = self.subjects(property_id, entity_id)
+                        covered = False
+                    if bindings or covered:
+                        groups[(entity_id, property_id)] = bindings
+        metrics.inc('triple_store', result='hit' if any(groups.values()) else 'miss')
+        return groups
+
+
+def format_value(datavalue):
+    """
+    Formats a value of a dump like the SPARQL endpoint returns it
+    :param datavalue: datavalue of a statement in the JSON dump (dict)
+    :return: kind, value and language (tuple of str), None if the type is not supported
+    """
+
+    value = datavalue['value']
+    value_type = datavalue['type']
+    if value_type == 'wikibase-entityid':
+        return ITEM, value['id'], ''
+    if value_type == 'string':
+        return LITERAL, clean(value), ''
+    if value_type == 'monolingualtext':
+        return LITERAL, clean(value['text']), value['language']
+    if value_type == 'time':
+        return LITERAL, value['time'].lstrip('+'), ''
+    if value_type == 'quantity':
+        return LITERAL, value['amount'].lstrip('+'), ''
+    if value_type == 'globecoordinate':
+        return LITERAL, 'Point({} {})'.format(value['longitude'], value['latitude']), ''
+    return None
+
+
+def truthy_statements(claims):
+    """
+    Selects the statements that the wdt: prefix returns: the preferred ones, or else the normal ones
+    :param claims: statements of one property (list)
+    :return: statements (list)
+    """
+
+    preferred = [claim for claim in claims if claim.get('rank') == 'preferred']
+    return preferred or [claim for claim in claims if claim.get('rank', 'normal') == 'normal']
+
+
+def read_dump(path):
+    """
+    Reads the entities of a Wikidata JSON dump, one entity per line
+    :param path: path to the dump, may be compressed with gzip or bzip2 (str)
+    :return: generator of entities (dict)
+    """
+
+    if path.endswith('.gz'):
+        f = gzip.open(path, 'rt', encoding='utf-8')
+    elif path.endswith('.bz2'):
+        f = bz2.open(path, 'rt', encoding='utf-8')
+    else:
+        f = open(path, 'r', encoding='utf-8')
+    with f:
+        for line in f:
+            line = line.strip().rstrip(',')
+            if line not in ('', '[', ']'):
+                yield json.loads(line)
+
+
+def build_triple_store(dumpfile, outdir, properties=None, labels_dumpfile=None):
+    """
+    Builds a store from a filtered Wikidata dump, e.g. only films and people
+    :param dumpfile: path to the JSON dump (str)
+    :param outdir: directory to write the store to (str)
+    :param properties: only keep these property IDs, all if None (set)
+    :param labels_dumpfile: path to a dump with the items that are values in the first dump, e.g. the full
+                            dump, only their English labels are read (str)
+    """
+
+    os.makedirs(outdir, exist_ok=True)
+    names = (SP_FILE, PO_FILE, LABELS_FILE, SUBJECTS_FILE)
+    unsorted = {name: tempfile.TemporaryFile('w+', encoding='utf-8', newline='\n') for name in names}
+    statements = 0
+    labelled = set()
+    referenced = set()  # Items that are values, e.g. countries and genres, which need a label too
+    for entity in read_dump(dumpfile):
+        entity_id = entity['id']
+        unsorted[SUBJECTS_FILE].write(entity_id + '\n')
+        label = entity.get('labels', {}).get('en')
+        if label:
+            unsorted[LABELS_FILE].write(entity_id + '\t' + clean(label['value']) + '\n')
+            labelled.add(entity_id)
+        for property_id, claims in entity.get('claims', {}).items():
+            if properties is not None and property_id not in properties:
+                continue
+            for claim in truthy_statements(claims):
+                datavalue = claim['mainsnak'].get('datavalue')  # No datavalue for 'no value' and 'unknown value'
+                value = format_value(datavalue) if datavalue else None
+                if value is None:
+                    continue
+                kind, text, lang = value
+                unsorted[SP_FILE].write("\t".join((entity_id, property_id, kind, text, lang)) + '\n')
+                if kind == ITEM:
+                    unsorted[PO_FILE].write("\t".join((property_id, text, entity_id)) + '\n')
+                    referenced.add(text)
+                statements += 1
+
+    unlabelled = referenced - labelled
+    del labelled, referenced
+    if labels_dumpfile:  # Second pass, only for the labels of the values
+        for entity in read_dump(labels_dumpfile):
+            label = entity.get('labels', {}).get('en')
+            if entity['id'] in unlabelled and label:
+                unsorted[LABELS_FILE].write(entity['id'] + '\t' + clean(label['value']) + '\n')
+                unlabelled.discard(entity['id'])
+    if properties is not None:
+        with open(os.path.join(outdir, PROPERTIES_FILE), 'w', encoding='utf-8') as f:
+            f.writelines(property_id + '\n' for property_id in sorted(properties))
+    elif os.path.exists(os.path.join(outdir, PROPERTIES_FILE)):  # Of an earlier build
+        os.remove(os.path.join(outdir, PROPERTIES_FILE))
+
+    for name, f in unsorted.items():
+        with f:
+            f.seek(0)
+            write_sorted((line.rstrip('\n') for line in f), os.path.join(outdir, name))
+    print("Stored {} statements".format(statements), file=sys.stderr)
+    if unlabelled:  # Lookups with these values are sent to the endpoint
+        print("{} items that are values have no English label".format(len(unlabelled)), file=sys.stderr)
+
+
+_store = None
+_store_path = None
+
+
+def configure(path=None):
+    """
+    Sets the store directory used by retrieve_answer, None only uses the SPARQL endpoint
+    :param path: path to the store directory (str)
+    """
+
+    global _store, _store_path
+    if _store is not None:
+        _store.close()
+    _store = None
+    _store_path = path
+
+
+def get_triple_store():
+    """
+    Returns the shared store, opening it on first use
+    :return: triple store (TripleStore), None if no store is configured
+    """
+
+    global _store
+    if _store is None and _store_path and os.path.isdir(_store_path):
+        _store = TripleStore(_store_path)
+    return _store
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='build a local store of Wikidata statements from a filtered dump')
+    parser.add_argument('dumpfile', help='path to the filtered JSON dump, may be gzipped or bzipped')
+    parser.add_argument('outdir', help='directory to write the store to')
+    parser.add_argument('--properties', help='only keep the properties of this property index file')
+    parser.add_argument('--labels', help='dump to read the English labels of the values from, e.g. the full dump')
+    args = parser.parse_args()
+
+    properties = None
+    if args.properties:
+        from property_index import load_property_index
+        properties = set(load_property_index(args.properties).labels)
+    build_triple_store(args.dumpfile, args.outdir, properties, args.labels)
+
+
+if __name__ == "__main__":
+    main()